@@ -1,26 +1,114 @@
+import os
 import json
+import time
+import base64
+import hashlib
+import random
+import uuid
 import boto3
 import numpy as np
-from supabase import create_client
+from supabase import create_client, ClientOptions
 from openai import OpenAI
 import requests
+from requests.adapters import HTTPAdapter
 import re
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Define global variables for API endpoints
 API_BASE_URL = os.environ.get("API_BASE_URL")
 USERNAME = os.environ.get("USERNAME")
 PASSWORD = os.environ.get("PASSWORD")
 
+# Backend calls share one keep-alive connection pool. Idempotent methods are
+# retried BACKEND_MAX_RETRIES times with jittered exponential backoff.
+BACKEND_CONNECT_TIMEOUT = float(os.environ.get("BACKEND_CONNECT_TIMEOUT", "3.05"))
+BACKEND_READ_TIMEOUT = float(os.environ.get("BACKEND_READ_TIMEOUT", "25"))
+BACKEND_MAX_RETRIES = int(os.environ.get("BACKEND_MAX_RETRIES", "2"))
+BACKEND_BACKOFF = float(os.environ.get("BACKEND_BACKOFF", "0.25"))
+BACKEND_POOL_SIZE = int(os.environ.get("BACKEND_POOL_SIZE", "10"))
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+RETRY_STATUS_CODES = frozenset([502, 503, 504])
+# Upper bounds (ms) of the backend latency histogram buckets
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Backend access tokens are reused across warm invocations and refreshed
+# TOKEN_REFRESH_MARGIN seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", "60"))
+# Lifetime assumed for tokens whose expiry cannot be decoded
+TOKEN_DEFAULT_TTL = int(os.environ.get("TOKEN_DEFAULT_TTL", "300"))
+
 # Initialize OpenAI API
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 #embedding_function = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
 client = OpenAI(api_key=OPENAI_API_KEY)
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Query embeddings are kept across warm invocations so repeated utterances
+# (greetings, intent names) skip the OpenAI round trip
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "512"))
+QUERY_EMBEDDING_TTL = int(os.environ.get("QUERY_EMBEDDING_TTL", "3600"))
 
 # Initialize Supabase client
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Intent and template catalogs searched in-process instead of through the
+# match_intent/match_template RPCs. They are reloaded in the background every
+# LOCAL_INDEX_TTL seconds; past LOCAL_INDEX_MAX_AGE the RPCs are used instead.
+# After a failed load the next attempt waits LOCAL_INDEX_RETRY seconds.
+INTENT_TABLE = os.environ.get("INTENT_TABLE", "intents")
+TEMPLATE_TABLE = os.environ.get("TEMPLATE_TABLE", "templates")
+LOCAL_INDEX_TTL = int(os.environ.get("LOCAL_INDEX_TTL", "300"))
+LOCAL_INDEX_MAX_AGE = int(os.environ.get("LOCAL_INDEX_MAX_AGE", "1800"))
+LOCAL_INDEX_RETRY = int(os.environ.get("LOCAL_INDEX_RETRY", "30"))
+# Template and document searches of the RAG path run concurrently; whatever
+# has not arrived after RETRIEVAL_TIMEOUT seconds is skipped. Their RPCs go
+# through a client with the same timeout, so a hung call gives its pool
+# thread back instead of holding it across invocations.
+RETRIEVAL_TIMEOUT = float(os.environ.get("RETRIEVAL_TIMEOUT", "5"))
+retrieval_pool = ThreadPoolExecutor(max_workers=4)
+retrieval_client = create_client(SUPABASE_URL, SUPABASE_KEY,
+                                 options=ClientOptions(postgrest_client_timeout=RETRIEVAL_TIMEOUT))
+
+# Related documentation is deduplicated, reranked with maximal marginal
+# relevance and packed into RAG_CONTEXT_TOKENS tokens of the prompt
+CHAT_MODEL = "gpt-4o-mini"
+RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", "3000"))
+RAG_MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", "0.7"))
+# Chunks sharing this fraction of their word 5-grams count as duplicates
+RAG_DUPLICATE_OVERLAP = float(os.environ.get("RAG_DUPLICATE_OVERLAP", "0.8"))
+
+# Generated templates are reused for requests whose query embeddings are
+# near-identical (cosine similarity >= RESPONSE_CACHE_THRESHOLD), answered
+# from the same context. Embeddings alone cannot tell "port 22" from
+# "port 443", so the request must also name the same specific values: numbers,
+# IP addresses and CIDRs, quoted values and the word after "named"/"called".
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.97"))
+
+# Stream the RAG completion and stop reading at the end of the Terraform block.
+# Partial output is pushed to the client's WebSocket connection when the
+# request carries a connection_id and WEBSOCKET_ENDPOINT (the API Gateway
+# management endpoint) is set. Pieces are posted from a background thread, at
+# most one message per WEBSOCKET_POST_INTERVAL seconds; whatever arrived in
+# between is sent together.
+RAG_STREAMING = os.environ.get("RAG_STREAMING", "true").lower() == "true"
+WEBSOCKET_ENDPOINT = os.environ.get("WEBSOCKET_ENDPOINT")
+WEBSOCKET_POST_INTERVAL = float(os.environ.get("WEBSOCKET_POST_INTERVAL", "0.1"))
+WEBSOCKET_CLOSE_TIMEOUT = float(os.environ.get("WEBSOCKET_CLOSE_TIMEOUT", "5"))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+except Exception:
+    # tiktoken is optional; fall back to a rough characters-per-token estimate
+    _encoding = None
+
 # Initialize DynamoDB client
 dynamodb = boto3.client('dynamodb')
 SESSION_TABLE = os.environ.get("SESSION_TABLE")
@@ -35,34 +123,308 @@ headers = {
         'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
         }
 
-def cosine_similarity(query_matrix, embedding_matrix):
-    """
-    Compute cosine similarity between a single query vector (1, N) and a set of embedding vectors (M, N).
-    Both query_matrix and embedding_matrix should be 2D arrays.
+class TTLCache:
+    """LRU cache whose entries expire ttl seconds after they were stored."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+class SemanticCache(TTLCache):
+    """TTLCache looked up by embedding similarity within a scope instead of by exact key."""
+
+    def __init__(self, max_entries, ttl, threshold):
+        super().__init__(max_entries, ttl)
+        self.threshold = threshold
+        self._next_id = 0
+
+    def find(self, query_embedding, scope):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        now = time.time()
+        best_key, best_similarity = None, self.threshold
+        for key, (expires, (vector, _)) in list(self.entries.items()):
+            if expires < now:
+                del self.entries[key]
+            elif key[0] == scope:
+                similarity = float(vector @ query)
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+        if best_key is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(best_key)
+        self.hits += 1
+        return self.entries[best_key][1][1]
+
+    def add(self, query_embedding, scope, value):
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        self.put((scope, self._next_id), (vector / (np.linalg.norm(vector) or 1), value))
+        self._next_id += 1
+
+query_embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_TTL)
+response_cache = SemanticCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_THRESHOLD)
+
+def embed_query(text):
+    """Embed a query, reusing the vector of an identical recent query."""
+    query_embedding = query_embedding_cache.get(text)
+    if query_embedding is None:
+        response = client.embeddings.create(
+                        input=text,
+                        model=EMBEDDING_MODEL,
+                        encoding_format="float"
+                    )
+        query_embedding = response.data[0].embedding
+        query_embedding_cache.put(text, query_embedding)
+    return query_embedding
+
+class QueryEmbedding:
+    """Embedding of one turn's input, computed on first use and shared by every lookup of the turn."""
+
+    def __init__(self, text):
+        self.text = text
+        self._vector = None
+
+    @property
+    def vector(self):
+        if self._vector is None:
+            self._vector = embed_query(self.text)
+        return self._vector
+
+class LocalVectorIndex:
     """
-    query_matrix = np.array(query_matrix)
-    embedding_matrix = np.array(embedding_matrix)
+    In-process copy of a small embeddings table that answers top-1 queries
+    with a single matrix product.
     
-    # Normalize the query vector and embedding matrix
-    query_norm = np.linalg.norm(query_matrix, axis=1, keepdims=True)  # (1, N)
-    embedding_norm = np.linalg.norm(embedding_matrix, axis=1, keepdims=True)  # (M, N)
-    
-    dot_product = np.dot(embedding_matrix, query_matrix.T).flatten()  # (M,)
+    Rows are kept next to a float32 matrix of their pre-normalized embeddings,
+    published together as one (rows, matrix, loaded_at) snapshot so a search
+    never pairs rows from one load with the matrix of another. The first
+    search loads the table; once the copy is older than ttl it is
+    reloaded on a background thread while searches keep using it; a failed
+    load is not retried for LOCAL_INDEX_RETRY seconds. search() returns None
+    when the index could not be loaded or is older than max_age, and callers
+    then fall back to the database RPC.
+    """
 
-    cosine_similarities = [dot_product] / (embedding_norm.flatten() * query_norm.flatten())
+    def __init__(self, table, columns, ttl=LOCAL_INDEX_TTL, max_age=LOCAL_INDEX_MAX_AGE):
+        self.table = table
+        self.columns = columns
+        self.ttl = ttl
+        self.max_age = max_age
+        self.snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._retry_at = 0
+
+    def load(self):
+        response = supabase_client.table(self.table).select(f"{self.columns}, embedding").execute()
+        rows = response.data
+        # pgvector columns come back as '[0.1, ...]' strings
+        vectors = [json.loads(row.pop('embedding')) if isinstance(row['embedding'], str) else row.pop('embedding')
+                   for row in rows]
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(rows), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        self.snapshot = (rows, matrix, time.time())
+        print(f"Loaded {len(rows)} rows of {self.table} into the local index")
+
+    def _refresh(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Failed to refresh the local {self.table} index: {e}")
+            self._retry_at = time.time() + LOCAL_INDEX_RETRY
+        finally:
+            self._refreshing = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.time() < self._retry_at:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def current(self):
+        """The (rows, matrix, loaded_at) snapshot to answer from, or None if the index cannot be used."""
+        if self.snapshot is None:
+            # Cold start: load synchronously, once
+            with self._lock:
+                if self.snapshot is None and not self._refreshing:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        print(f"Failed to load the local {self.table} index: {e}")
+                        self.snapshot = ([], np.zeros((0, 0), dtype=np.float32), 0)
+                        self._retry_at = time.time() + LOCAL_INDEX_RETRY
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        age = time.time() - snapshot[2]
+        if age > self.ttl:
+            self.refresh_in_background()
+        if not snapshot[0] or age > self.max_age:
+            return None
+        return snapshot
+
+    def search(self, query_embedding):
+        """Return (row, similarity) of the closest row, or None if the index cannot be used."""
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        rows, matrix, _ = snapshot
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities = matrix @ (query / (np.linalg.norm(query) or 1))
+        best = int(np.argmax(similarities))
+        return rows[best], float(similarities[best])
+
+intent_index = LocalVectorIndex(INTENT_TABLE, "intent")
+template_index = LocalVectorIndex(TEMPLATE_TABLE, "intent, template, required_slots, method, endpoint")
+
+def match_template(query_embedding):
+    """Best matching template row, from the local index or the match_template RPC."""
+    match = template_index.search(query_embedding)
+    if match is not None:
+        return match[0]
+    template = retrieval_client.rpc(
+        "match_template",  # Postgres function for template similarity search
+        {"query_embedding": query_embedding}
+    ).execute()
+    return template.data[0] if template.data else None
 
-    return cosine_similarities
+def match_docs(query_embedding):
+    """Related documentation chunks from the match_docs RPC."""
+    docs_response = retrieval_client.rpc(
+        "match_docs",  # Postgres function for document similarity search
+        {"query_embedding": query_embedding}
+    ).execute()
+    return docs_response.data or []
+
+def run_parallel(calls, timeout=RETRIEVAL_TIMEOUT):
+    """
+    Run independent calls on the retrieval pool and wait at most timeout seconds for all of them.
+    Returns one (ok, result) pair per call; ok is False for calls that failed or did not finish in time.
+    """
+    futures = [retrieval_pool.submit(fn, *args) for fn, *args in calls]
+    wait(futures, timeout=timeout)
+    results = []
+    for (fn, *_), future in zip(calls, futures):
+        if not future.done():
+            print(f"{fn.__name__} did not finish within {timeout}s, continuing without it")
+            # Only stops calls still queued; a running one ends at its own client timeout
+            future.cancel()
+            results.append((False, None))
+        elif future.exception() is not None:
+            print(f"{fn.__name__} failed: {future.exception()}")
+            results.append((False, None))
+        else:
+            results.append((True, future.result()))
+    return results
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+def _shingles(text, size=5):
+    words = re.findall(r'\w+', text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _overlap(a, b):
+    """Share of the smaller shingle set found in the other one (1.0 when one chunk contains the other)."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+def _similarity(a, b):
+    if a['vector'] is not None and b['vector'] is not None:
+        return float(a['vector'] @ b['vector'])
+    return _overlap(a['shingles'], b['shingles'])
+
+def build_context(docs, query_embedding, budget=RAG_CONTEXT_TOKENS, mmr_lambda=RAG_MMR_LAMBDA):
+    """
+    Pick the documentation chunks that go into the RAG prompt.
+    
+    Overlapping chunks are collapsed into the most relevant one, the rest are
+    ordered by maximal marginal relevance (embeddings when match_docs returns
+    them, word overlap otherwise) and packed greedily into `budget` tokens.
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1)
+    candidates = []
+    for rank, doc in enumerate(docs):
+        content = doc.get('content') or ''
+        if not content.strip():
+            continue
+        vector = doc.get('embedding')
+        if vector is not None:
+            # pgvector columns come back as '[0.1, ...]' strings
+            vector = np.asarray(json.loads(vector) if isinstance(vector, str) else vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1)
+        relevance = doc.get('similarity')
+        if relevance is None:
+            relevance = float(vector @ query) if vector is not None else 1 - rank / len(docs)
+        candidates.append({'content': content, 'shingles': _shingles(content), 'vector': vector,
+                           'relevance': relevance, 'tokens': count_tokens(content)})
+    candidates.sort(key=lambda candidate: candidate['relevance'], reverse=True)
+
+    unique = []
+    duplicate_tokens = 0
+    for candidate in candidates:
+        if any(_overlap(candidate['shingles'], kept['shingles']) >= RAG_DUPLICATE_OVERLAP for kept in unique):
+            duplicate_tokens += candidate['tokens']
+        else:
+            unique.append(candidate)
+
+    selected = []
+    used_tokens = over_budget_tokens = 0
+    while unique:
+        best = max(unique, key=lambda candidate: mmr_lambda * candidate['relevance'] - (1 - mmr_lambda) * max(
+            (_similarity(candidate, chosen) for chosen in selected), default=0.0))
+        unique.remove(best)
+        if used_tokens + best['tokens'] > budget:
+            over_budget_tokens += best['tokens']
+            continue
+        selected.append(best)
+        used_tokens += best['tokens']
+
+    print(f"RAG context: {len(selected)} of {len(docs)} docs, {used_tokens} tokens used, "
+          f"{duplicate_tokens + over_budget_tokens} tokens dropped "
+          f"({duplicate_tokens} duplicate, {over_budget_tokens} over the {budget} token budget)")
+    return [candidate['content'] for candidate in selected]
 
 # Helper functions
 
 
-def get_intent_vectorsearch(user_input, threshold=0.8):
-    response = client.embeddings.create(
-                    input=user_input,
-                    model="text-embedding-ada-002",  
-                    encoding_format="float"
-                )
-    query_embedding = response.data[0].embedding
+def get_intent_vectorsearch(user_input, threshold=0.8, query=None):
+    query_embedding = (query or QueryEmbedding(user_input)).vector
+
+    match = intent_index.search(query_embedding)
+    if match is not None:
+        row, similarity = match
+        return row["intent"] if similarity >= threshold else None
 
     intent_response = supabase_client.rpc(
         "match_intent",  
@@ -75,21 +437,11 @@ def get_intent_vectorsearch(user_input, threshold=0.8):
 
 """Retrieve the best matching template from Supabase based on user input."""
 
-def retrieve_template(user_input):    
-    response = client.embeddings.create(
-                    input=user_input,
-                    model="text-embedding-ada-002",  
-                    encoding_format="float"
-                )
-    query_embedding = response.data[0].embedding
-    
-    template = supabase_client.rpc(
-        "match_template",  
-        {"query_embedding": query_embedding}
-    ).execute()
+def retrieve_template(user_input, query=None):
+    query_embedding = (query or QueryEmbedding(user_input)).vector
 
-    if(template.data):
-        matching_template = template.data[0]  # Assuming "intent_name" is the column for intent
+    matching_template = match_template(query_embedding)
+    if(matching_template):
         return(
                 matching_template["intent"],
                 matching_template["template"],
@@ -99,13 +451,50 @@ def retrieve_template(user_input):
             )
     return None, None, None, None, None
 
-def update_session(user_id, session_id, intent=None, slots=None):
-    """Update session state in DynamoDB."""
+class TemplateRegistry:
+    """Templates keyed by intent name, built from the rows of the template index's current snapshot."""
+
+    def __init__(self, index):
+        self.index = index
+        # (snapshot the templates were built from, templates)
+        self.built = (None, {})
+
+    def get(self, intent):
+        snapshot = self.index.current()
+        if snapshot is None:
+            return None
+        source, templates = self.built
+        if source is not snapshot:
+            templates = {
+                row["intent"].strip().lower(): (row["template"], row["required_slots"], row["method"], row["endpoint"])
+                for row in snapshot[0]
+            }
+            self.built = (snapshot, templates)
+        return templates.get(intent.strip().lower())
+
+template_registry = TemplateRegistry(template_index)
+
+def lookup_template(intent, user_input=None, query=None):
+    """
+    Resolve (template, required_slots, method, endpoint) for a known intent.
+    Falls back to a similarity search (on user_input if given, else on the intent name)
+    for intents missing from the registry.
+    """
+    template = template_registry.get(intent)
+    if template is not None:
+        return template
+    print(f"No template registered for intent {intent}, searching by similarity")
+    _, template, required_slots, method, endpoint = retrieve_template(user_input or intent, query=query)
+    return template, required_slots, method, endpoint
+
+def update_session(user_id, session_id, intent=None, slots=None, request=None):
+    """Update session state in DynamoDB. request is the message the intent was identified from."""
     session_data = {
         'SessionID': {'S': session_id},
         'UserId': {'S': user_id},
         'Intent': {'S': intent or ""},
-        'Slots': {'S': json.dumps(slots or {})}
+        'Slots': {'S': json.dumps(slots or {})},
+        'Request': {'S': request or ""}
     }
     dynamodb.put_item(TableName=SESSION_TABLE, Item=session_data)
 
@@ -116,12 +505,161 @@ def get_session(session_id):
         if 'Item' in response:
             return {
                 'intent': response['Item']['Intent']['S'],
-                'slots': json.loads(response['Item']['Slots']['S'])
+                'slots': json.loads(response['Item']['Slots']['S']),
+                'request': response['Item'].get('Request', {}).get('S')
             }
     except Exception as e:
         print(f"Error retrieving session: {e}")
-    return {'intent': None, 'slots': {}}
+    return {'intent': None, 'slots': {}, 'request': None}
+
+class LatencyHistogram:
+    """Request latencies bucketed per (method, endpoint)."""
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, endpoint, seconds, outcome):
+        elapsed_ms = seconds * 1000
+        bucket = next((i for i, bound in enumerate(self.buckets_ms) if elapsed_ms <= bound), len(self.buckets_ms))
+        with self._lock:
+            series = self.series.setdefault(f"{method} {endpoint}", {
+                'counts': [0] * (len(self.buckets_ms) + 1), 'count': 0, 'sum_ms': 0.0, 'outcomes': {}
+            })
+            series['counts'][bucket] += 1
+            series['count'] += 1
+            series['sum_ms'] += elapsed_ms
+            series['outcomes'][outcome] = series['outcomes'].get(outcome, 0) + 1
+
+    def export(self):
+        """Snapshot of every series; counts[i] is the number of requests <= buckets_ms[i] (last: overflow)."""
+        with self._lock:
+            return {
+                'buckets_ms': list(self.buckets_ms),
+                'series': {name: dict(series, counts=list(series['counts']), outcomes=dict(series['outcomes']))
+                           for name, series in self.series.items()}
+            }
+
+class BackendClient:
+    """Keep-alive session for API_BASE_URL with timeouts, retries and latency metrics."""
+
+    def __init__(self, base_url, pool_size=BACKEND_POOL_SIZE, max_retries=BACKEND_MAX_RETRIES):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.latency = LatencyHistogram()
+
+    def request(self, method, endpoint, **kwargs):
+        method = method.upper()
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, f"{self.base_url}{endpoint}",
+                    timeout=(BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT), **kwargs
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.latency.observe(method, endpoint, time.perf_counter() - start, type(e).__name__)
+                if attempt == retries:
+                    raise
+                print(f"{method} {endpoint} failed ({e}), retrying")
+            else:
+                self.latency.observe(method, endpoint, time.perf_counter() - start, str(response.status_code))
+                if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                    return response
+                print(f"{method} {endpoint} returned {response.status_code}, retrying")
+            # Full jitter keeps concurrent Lambdas from retrying in lockstep
+            time.sleep(random.uniform(0, BACKEND_BACKOFF * 2 ** attempt))
+
+backend = BackendClient(API_BASE_URL)
+
+def jwt_expiry(token):
+    """Read the exp claim (epoch seconds) of a JWT without verifying it; None if it cannot be read."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+    except Exception:
+        return None
 
+class TokenManager:
+    """
+    Backend access token cached across warm invocations.
+    
+    The token is renewed TOKEN_REFRESH_MARGIN seconds before it expires, with the
+    refresh token when the backend issued one and it is still valid, otherwise
+    by logging in again.
+    """
+
+    def __init__(self, margin=TOKEN_REFRESH_MARGIN):
+        self.margin = margin
+        self.access = None
+        self.access_expires = 0
+        self.refresh = None
+        self.refresh_expires = 0
+        # Tokens obtained and tokens handed out, across warm invocations
+        self.fetches = 0
+        self.uses = 0
+        self._lock = threading.Lock()
+
+    def _store(self, data):
+        self.access = data['access']
+        self.access_expires = jwt_expiry(self.access) or time.time() + TOKEN_DEFAULT_TTL
+        if data.get('refresh'):
+            self.refresh = data['refresh']
+            self.refresh_expires = jwt_expiry(self.refresh) or 0
+        self.fetches += 1
+
+    def get(self):
+        with self._lock:
+            self.uses += 1
+            now = time.time()
+            if self.access and now < self.access_expires - self.margin:
+                return self.access
+            if self.refresh and now < self.refresh_expires - self.margin:
+                try:
+                    refresh_response = backend.request("POST", "/api/token/refresh/", json={"refresh": self.refresh})
+                    refresh_response.raise_for_status()
+                    self._store(refresh_response.json())
+                    return self.access
+                except Exception as e:
+                    print("Token refresh failed, logging in again:", str(e))
+            auth_response = backend.request("POST", "/api/token/", json={"username": USERNAME, "password": PASSWORD})
+            auth_response.raise_for_status()
+            self._store(auth_response.json())
+            return self.access
+
+    def invalidate(self, token):
+        """Drop a token the backend rejected (unless it was already replaced)."""
+        with self._lock:
+            if self.access == token:
+                self.access = None
+
+token_manager = TokenManager()
+
+def call_backend(method, endpoint, data_payload):
+    """Call the backend API with the cached token, retrying once with a new token on 401."""
+    for attempt in range(2):
+        token = token_manager.get()
+        headers_auth = {"Authorization": f"Bearer {token}"}
+        api_response = backend.request(method, endpoint, json=data_payload, headers=headers_auth)
+        if api_response.status_code != 401 or attempt:
+            break
+        print("Backend rejected the cached token, fetching a new one")
+        token_manager.invalidate(token)
+    api_response.raise_for_status()
+    return api_response
+
+def log_backend_metrics():
+    """Print backend latencies and token fetches per use, both counted since the cold start."""
+    print("Backend latency:", json.dumps(backend.latency.export()))
+    print("Backend tokens:", json.dumps({'fetches': token_manager.fetches, 'uses': token_manager.uses}))
 
 def lambda_handler(event, context):
 
@@ -129,6 +667,9 @@ def lambda_handler(event, context):
     user_id = event['requestContext']['authorizer']['claims']['email']
     session_id = json.loads(event['body'])['session_id']
     user_input = json.loads(event['body'])['message']
+    # Clients can ask for a freshly generated template
+    use_cache = not json.loads(event['body']).get('no_cache', False)
+    connection_id = json.loads(event['body']).get('connection_id')
 
     if not user_input:
         return {
@@ -141,40 +682,50 @@ def lambda_handler(event, context):
     session = get_session(session_id)
     intent = session['intent']
     slots = session['slots']
+    request = session['request']
 
     print("retrive session state")
     print("Intent:", intent)
 
+    # The input is embedded at most once per turn, however many lookups use it
+    query = QueryEmbedding(user_input)
+
     if not intent:
         # Identify intent if not already identified
-        intent = get_intent_vectorsearch(user_input)
+        intent = get_intent_vectorsearch(user_input, query=query)
         print("Identified Int:", intent)
         if intent:
+            request = user_input
             if(intent =='hi hello'):
                 return {
                 'statusCode': 200,
                 'headers': headers,
                 'body': json.dumps({'response': f"Hi {user_id}, how may I assist you today with your AWS infrastructure?"})
             }
-            if(intent =='Create a security group'):
-                data = retrieve_and_generate_rag(user_input)
+            template, required_slots, _, _ = lookup_template(intent, user_input, query=query)
+
+            # A stored template with slot placeholders is filled from slots (at
+            # fulfillment, below); any other request goes to the LLM with the
+            # user's own words
+            if(intent =='Create a security group' and not template_slots(template, required_slots)):
+                with websocket_forwarder(connection_id) as forward:
+                    data = retrieve_and_generate_rag(user_input, query=query, use_cache=use_cache, on_delta=forward)
                 data_payload = {
                     "file_data": data
                 }
-                send_rag_post_req(data_payload, "POST", "/api/custom/", user_id, session_id)
+                send_rag_post_req(data_payload, "POST", "/api/custom/", user_id, session_id, intent)
                 return {
                 'statusCode': 200,
                 'headers': headers,
                 'body': json.dumps({'response': f"We have processed your request to {intent}. Please wait while we fetch the resources."})
                 }
 
-            _, _, required_slots, _, _ = retrieve_template(user_input)
 
             if(required_slots):
                 slots = {slot: None for slot in required_slots}
             else:
                 slots = None
-            update_session(user_id, session_id, intent, slots)
+            update_session(user_id, session_id, intent, slots, request)
             
             if(required_slots):
                 return {
@@ -201,7 +752,7 @@ def lambda_handler(event, context):
                         'headers': headers,
                         'body': json.dumps({'response': f"Sorry, that is an incorrect value for {slot}. Please provide it again."})
                     }
-                update_session(user_id, session_id, intent, slots)
+                update_session(user_id, session_id, intent, slots, request)
                 next_slot = next((s for s, v in slots.items() if v is None), None)
                 if next_slot:
                     return {
@@ -213,8 +764,7 @@ def lambda_handler(event, context):
     
     print("slots:", slots)
     # If all slots are filled, fulfill the request
-    _, template, _, method, endpoint = retrieve_template(intent)
-    #filled_template = template.format(**slots)
+    template, _, method, endpoint = lookup_template(intent)
     
     if(intent == 'Create an EC2 instance'):
         data_payload = {
@@ -277,31 +827,41 @@ def lambda_handler(event, context):
         "resource_name": slots["Resource Name"]
         }
 
-    # Call external API endpoints
-    auth_response = requests.post(
-        f"{API_BASE_URL}/api/token/",
-        json={"username": USERNAME, "password": PASSWORD},
-        verify=False
-    )
-
-    auth_response.raise_for_status()
-    token = auth_response.json().get('access')
-    
-    headers_auth = {"Authorization": f"Bearer {token}"}
+    else:
+        # Any other templated intent: render the stored template from the slots
+        filled_template = render_template(template, slots)
+        if filled_template is None and not template:
+            update_session(user_id, session_id)
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({
+                    'response': f"Sorry, I don't know how to {intent} yet."
+                })
+            }
+        if filled_template is None:
+            # The template cannot be filled from slots: let the LLM adapt it to
+            # the user's original request and the details collected for it
+            prompt = ", ".join([request or intent] + [f"{slot}: {value}" for slot, value in (slots or {}).items()])
+            with websocket_forwarder(connection_id) as forward:
+                data = retrieve_and_generate_rag(prompt, use_cache=use_cache, on_delta=forward)
+            send_rag_post_req({"file_data": data}, "POST", "/api/custom/", user_id, session_id, intent)
+            return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({'response': f"We have processed your request to {intent}. Please wait while we fetch the resources."})
+            }
+        data_payload = {
+        "file_data": filled_template
+        }
 
     print("method:", method)
     print("endpoint", endpoint)
     print("Payload", data_payload)
 
+    # Call external API endpoints
     try:
-        api_response  = requests.request(
-            method=method.upper(),
-            url=f"{API_BASE_URL}{endpoint}",
-            json=data_payload,
-            headers=headers_auth,
-            verify=False
-            )
-        api_response.raise_for_status()
+        api_response = call_backend(method, endpoint, data_payload)
     except Exception as e:
         print("Error occurred during API request:", str(e))
         update_session(user_id, session_id)
@@ -316,6 +876,7 @@ def lambda_handler(event, context):
     
 
     print("Response Status Code:", api_response.status_code)
+    log_backend_metrics()
 
     #For DELETE requests
     if(api_response.status_code == 204):
@@ -333,8 +894,9 @@ def lambda_handler(event, context):
     if(api_response.status_code == 201):
         api_result = api_response.json()
         print("API POST Results:", api_result)
-        key_id = api_result['key_id']
-        update_key_id(session_id, user_id, key_id)
+        key_id = api_result.get('key_id')
+        if key_id:
+            update_key_id(session_id, user_id, key_id)
         update_session(user_id, session_id)
         # Clears the session intent and session_id once fullfilled
         # Ready to accept new requests
@@ -382,44 +944,264 @@ def validate_slot(slot, value):
     # Add validation logic for slots based on type, format, etc.
     return True
 
-def retrieve_and_generate_rag(user_input):
+# Slot placeholders in stored templates: {{Slot Name}} or {Slot Name}. Single
+# braces only count when they name a known slot, so HCL blocks are left alone.
+PLACEHOLDER_RE = re.compile(r'\{\{\s*([^{}\n]+?)\s*\}\}|\{([^{}\n]+)\}')
+
+def _slot_key(name):
+    return " ".join(name.split()).lower()
+
+def escape_hcl(value):
+    """Escape a slot value for use inside an HCL string literal."""
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    value = value.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+    # Keep values from opening interpolations or template directives
+    return value.replace('${', '$${').replace('%{', '%%{')
+
+def template_slots(template, slots):
+    """The slots, out of slots, that a stored template has a placeholder for."""
+    names = {_slot_key(slot): slot for slot in slots or ()}
+    found = set()
+    for match in PLACEHOLDER_RE.finditer(template or ""):
+        key = _slot_key(match.group(1) or match.group(2))
+        if key in names:
+            found.add(names[key])
+    return found
+
+def render_template(template, slots):
     """
-    Implements a RAG workflow using both template and related documents.
+    Fill a stored Terraform template with slot values, without calling the LLM.
+    Returns None when the template has no slot placeholders, a {{placeholder}} has no value or a slot
+    is invalid, so the caller can fall back to generating it.
     """
-    # Step 1: Generate embedding for user input
-    response = client.embeddings.create(
-                    input=user_input,
-                    model="text-embedding-ada-002",  
-                    encoding_format="float"
-                )
-    query_embedding = response.data[0].embedding
+    if not template:
+        return None
+    values = {_slot_key(slot): value for slot, value in (slots or {}).items()}
+    for slot, value in (slots or {}).items():
+        if value is None or not validate_slot(slot, value):
+            return None
+    missing = []
+    filled = []
+
+    def substitute(match):
+        name = match.group(1) or match.group(2)
+        key = _slot_key(name)
+        if key in values:
+            filled.append(name)
+            return escape_hcl(values[key])
+        if match.group(1):
+            missing.append(name)
+        return match.group(0)
+
+    rendered = PLACEHOLDER_RE.sub(substitute, template)
+    if not filled:
+        print("Template has no slot placeholders")
+        return None
+    if missing:
+        print(f"Template has no values for {missing}")
+        return None
+    return rendered
 
-    # Step 2: Retrieve the most relevant template
-    template_response = supabase_client.rpc(
-        "match_template",  # Postgres function for template similarity search
-        {"query_embedding": query_embedding}
-    ).execute()
+class FenceExtractor:
+    """
+    Incrementally extract the first ```hcl or ```terraform block from streamed text.
+    feed() returns the part of the block that became known with this piece; done is set once the
+    closing fence has arrived.
+    """
 
-    if not template_response.data or len(template_response.data) == 0:
-        return "No matching template found."
+    OPENING_RE = re.compile(r"```(?:hcl|terraform)[ \t]*\n")
+    CLOSING = "\n```"
+
+    def __init__(self):
+        self.pending = ""
+        self.inside = False
+        self.leading_newline = False
+        self.done = False
+        self.parts = []
+
+    def feed(self, text):
+        if self.done:
+            return ""
+        self.pending += text
+        if not self.inside:
+            opening = self.OPENING_RE.search(self.pending)
+            if opening is None:
+                return ""
+            self.inside = True
+            self.leading_newline = True
+            # Keep the newline so a block closed right away is still found
+            self.pending = "\n" + self.pending[opening.end():]
+        closing = self.pending.find(self.CLOSING)
+        if closing != -1:
+            emitted, self.pending, self.done = self.pending[:closing], "", True
+        else:
+            # Hold back what could be the start of the closing fence
+            safe = max(0, len(self.pending) - len(self.CLOSING) + 1)
+            emitted, self.pending = self.pending[:safe], self.pending[safe:]
+        if emitted and self.leading_newline:
+            # Drop the newline added after the opening fence
+            emitted = emitted[1:]
+            self.leading_newline = False
+        if emitted:
+            self.parts.append(emitted)
+        return emitted
+
+    @property
+    def payload(self):
+        """The extracted block, or None until its closing fence has arrived."""
+        return "".join(self.parts).strip() if self.done else None
+
+def stream_completion(messages, on_delta=None, chat_client=None):
+    """
+    Stream a chat completion and extract its Terraform block on the fly.
+    on_delta receives each new piece of the block as it arrives. Reading stops as soon as the
+    closing fence is seen.
+    Returns (payload or None, generated text, timings in seconds).
+    """
+    start = time.perf_counter()
+    timings = {}
+    extractor = FenceExtractor()
+    generated = []
+    stream = (chat_client or client).chat.completions.create(model=CHAT_MODEL, messages=messages, stream=True)
+    try:
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            text = chunk.choices[0].delta.content
+            timings.setdefault('first_token', time.perf_counter() - start)
+            generated.append(text)
+            piece = extractor.feed(text)
+            if piece:
+                timings.setdefault('first_payload', time.perf_counter() - start)
+                if on_delta is not None:
+                    on_delta(piece)
+            if extractor.done:
+                timings['fence_closed'] = time.perf_counter() - start
+                break
+    finally:
+        # Drop the rest of the response once the block is complete
+        stream.close()
+    timings['total'] = time.perf_counter() - start
+    return extractor.payload, "".join(generated), timings
 
-    # Step 3: Retrieve related documents
-    docs_response = supabase_client.rpc(
-        "match_docs",  # Postgres function for document similarity search
-        {"query_embedding": query_embedding}
-    ).execute()
+class WebSocketForwarder:
+    """
+    Push partial output to a WebSocket connection without holding up the completion stream.
+    Calling it only queues the piece; a sender thread posts what has queued up as one message,
+    at most once per interval. Use it as a context manager so the rest is sent before returning.
+    """
 
+    def __init__(self, connection_id, websocket, interval=WEBSOCKET_POST_INTERVAL):
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.interval = interval
+        self.pending = []
+        self.closed = False
+        self.pieces = 0
+        self.posts = 0
+        self._condition = threading.Condition()
+        self._sender = threading.Thread(target=self._run, daemon=True)
+        self._sender.start()
+
+    def __call__(self, text):
+        with self._condition:
+            self.pending.append(text)
+            self.pieces += 1
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                text, self.pending = "".join(self.pending), []
+            try:
+                self.websocket.post_to_connection(ConnectionId=self.connection_id,
+                                                  Data=json.dumps({'partial': text}).encode('utf-8'))
+                self.posts += 1
+            except Exception as e:
+                print("Failed to forward partial output:", str(e))
+            # Let the next pieces gather; closing cuts the wait short
+            with self._condition:
+                self._condition.wait_for(lambda: self.closed, timeout=self.interval)
+
+    def close(self, timeout=WEBSOCKET_CLOSE_TIMEOUT):
+        """Send what is still queued and stop the sender, waiting at most timeout seconds."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self._sender.join(timeout)
+        print(f"Forwarded {self.pieces} pieces in {self.posts} messages")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def websocket_forwarder(connection_id):
+    """WebSocketForwarder for the connection, or a context giving None if streaming to the client is not set up."""
+    if not connection_id or not WEBSOCKET_ENDPOINT:
+        return contextlib.nullcontext()
+    return WebSocketForwarder(connection_id, boto3.client('apigatewaymanagementapi', endpoint_url=WEBSOCKET_ENDPOINT))
+
+# Unique name suffixes the prompt asks the model to append
+UUID_RE = re.compile(r'[0-9a-f]{8}([-_])[0-9a-f]{4}\1[0-9a-f]{4}\1[0-9a-f]{4}\1[0-9a-f]{12}', re.IGNORECASE)
+
+REQUEST_DETAIL_RE = re.compile(r"\d+(?:\.\d+){3}(?:/\d+)?|\d+(?:\.\d+)?|\"[^\"]*\"|'[^']*'|\b(?:named|called)\s+\S+",
+                               re.IGNORECASE)
+
+def response_scope(user_input, related_docs):
+    """Response cache scope: the specific values the request names and the documents it was answered from."""
+    details = sorted(set(detail.lower() for detail in REQUEST_DETAIL_RE.findall(user_input)))
+    return hashlib.sha256(json.dumps([details, sorted(related_docs)]).encode('utf-8')).hexdigest()
+
+def refresh_unique_suffixes(payload):
+    """Replace every uuid in a cached template with a new one, consistently across its uses."""
+    fresh = {}
+
+    def replace(match):
+        # Key on the digits so a uuid written with '-' and with '_' stays one name
+        old = match.group(0).lower().replace(match.group(1), '')
+        if old not in fresh:
+            fresh[old] = str(uuid.uuid4())
+        return fresh[old].replace('-', match.group(1))
+
+    return UUID_RE.sub(replace, payload)
+
+def retrieve_and_generate_rag(user_input, query=None, use_cache=True, on_delta=None):
+    """
+    Implements a RAG workflow using both template and related documents.
+    """
+    # Step 1: Generate embedding for user input (reusing the turn's embedding)
+    query_embedding = (query or QueryEmbedding(user_input)).vector
 
+    # Step 2 and 3: Retrieve the most relevant template and related documents concurrently
+    (template_ok, retrieved_template), (_, docs) = run_parallel([
+        (match_template, query_embedding),
+        (match_docs, query_embedding),
+    ])
 
-    # Retrieve context from template
-    retrieved_template = template_response.data[0]
-    template_text = retrieved_template['template']
-    required_slots = retrieved_template['required_slots']
+    if template_ok and not retrieved_template:
+        return "No matching template found."
 
     # Retrieve related documents
-    related_docs = []
-    if docs_response.data and len(docs_response.data) > 0:
-        related_docs = [doc['content'] for doc in docs_response.data]
+    related_docs = build_context(docs or [], query_embedding)
+    related_text = "\n\n".join(related_docs)
+
+    # A near-identical request naming the same values over the same documents
+    # gets the same template, with fresh unique names
+    scope = response_scope(user_input, related_docs)
+    if use_cache:
+        cached_payload = response_cache.find(query_embedding, scope)
+        print("Response cache:", response_cache.stats())
+        if cached_payload is not None:
+            cached_payload = refresh_unique_suffixes(cached_payload)
+            print("Payload (cached)", cached_payload)
+            if on_delta is not None:
+                on_delta(cached_payload)
+            return cached_payload
 
     base_template = """
     resource "aws_instance" "ec2_compute_instance" {
@@ -438,7 +1220,7 @@ def retrieve_and_generate_rag(user_input):
     augmented_prompt = (
         f"User Input: {user_input}\n\n"
         f"Base Template:\n{base_template}\n\n"
-        f"Related Documentation:\n{''.join(related_docs)}\n\n"
+        f"Related Documentation:\n{related_text}\n\n"
         "Based on the user input, retrieve base template, and additional related information, reuse key values or defaults from the template when possible\n"
         "- Try to generate for the exact task in user prompt and only that"
         "- Add new resource group if and only if necessary.\n"
@@ -449,66 +1231,62 @@ def retrieve_and_generate_rag(user_input):
     )
 
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant. Only generate terraform template without additional text"},
-            {
-                "role": "user",
-                "content": augmented_prompt
-            }
-        ]
-    )
-    
-    generated_template = response.choices[0].message.content
-
-    print("Generated:",generated_template)
-
-    pattern1 = r"```hcl\n(.*?)\n```"
-    pattern2 = r"```terraform\n(.*?)\n```"
-    # Search and extract the payload
-    match = re.search(pattern1, generated_template, re.DOTALL)
-    payload1 = match.group(1).strip() if match else None
-  
-    match = re.search(pattern2, generated_template, re.DOTALL)
-    payload2 = match.group(1).strip() if match else None
-
-    if(payload1):
-        print("Payload1", payload1)
-        return payload1
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant. Only generate terraform template without additional text"},
+        {
+            "role": "user",
+            "content": augmented_prompt
+        }
+    ]
+
+    if RAG_STREAMING:
+        payload, generated_template, timings = stream_completion(messages, on_delta)
+        print("Generated:", generated_template)
+        print("Generation timings:", json.dumps(timings))
+        print("Payload", payload)
     else:
-        print("Payload2", payload2)
-        return payload2
+        response = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages
+        )
+
+        generated_template = response.choices[0].message.content
+
+        print("Generated:",generated_template)
+
+        pattern1 = r"```hcl\n(.*?)\n```"
+        pattern2 = r"```terraform\n(.*?)\n```"
+        # Search and extract the payload
+        match = re.search(pattern1, generated_template, re.DOTALL)
+        payload1 = match.group(1).strip() if match else None
+
+        match = re.search(pattern2, generated_template, re.DOTALL)
+        payload2 = match.group(1).strip() if match else None
+
+        if(payload1):
+            print("Payload1", payload1)
+            payload = payload1
+        else:
+            print("Payload2", payload2)
+            payload = payload2
+
+    # Only templates whose unique names can be regenerated are reused
+    if use_cache and payload and UUID_RE.search(payload):
+        response_cache.add(query_embedding, scope, payload)
+    return payload
     
 
 
 
-def send_rag_post_req(data_payload, method, endpoint, user_id, session_id):
+def send_rag_post_req(data_payload, method, endpoint, user_id, session_id, intent):
     # Call external API endpoints
     print("Dat Payload:", data_payload)
-    auth_response = requests.post(
-        f"{API_BASE_URL}/api/token/",
-        json={"username": USERNAME, "password": PASSWORD},
-        verify=False
-    )
-    auth_response.raise_for_status()
-    token = auth_response.json().get('access')
-    
-    headers_auth = {"Authorization": f"Bearer {token}"}
-
     print("method:", method)
     print("endpoint", endpoint)
     print("Payload", data_payload)
 
     try:
-        api_response  = requests.request(
-            method=method.upper(),
-            url=f"{API_BASE_URL}{endpoint}",
-            json=data_payload,
-            headers=headers_auth,
-            verify=False
-            )
-        api_response.raise_for_status()
+        api_response = call_backend(method, endpoint, data_payload)
     except Exception as e:
         print("Error occurred during API request:", str(e))
         update_session(user_id, session_id)
@@ -519,6 +1297,7 @@ def send_rag_post_req(data_payload, method, endpoint, user_id, session_id):
                 'response': f"Seems like your request to {intent} failed."
             })
         }
+    log_backend_metrics()
     
     # Clears the session intent and session_id once fullfilled
     update_session(user_id, session_id)
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import fnmatch
+import argparse
+from supabase import create_client
+from openai import OpenAI
+
+from kbPipeline import (
+    STREAM_READ_SIZE, ChunkWriter, failed_files, get_embedding_cache, index_files, iter_text_lines, new_generation,
+    publish_generation
+)
+
+def load_checkpoint(path):
+    """
+    Read the set of files already indexed by a previous run
+
+    Args:
+        path (str): Checkpoint file
+
+    Returns:
+        dict: Checkpoint with 'completed' (list of files) and 'stats'
+    """
+    if not os.path.exists(path):
+        return {'completed': [], 'stats': {'chunks': 0, 'tokens': 0, 'seconds': 0.0}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path, checkpoint):
+    """
+    Write the checkpoint atomically so an interrupted run never leaves it half-written
+
+    Args:
+        path (str): Checkpoint file
+        checkpoint (dict): Checkpoint to save
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+def find_files(directory, root, pattern):
+    """
+    List the files to index, as paths relative to root
+
+    Args:
+        directory (str): Directory to walk
+        root (str): Repository root; source_file values are relative to it
+        pattern (str): Glob matched against file names
+
+    Returns:
+        list: Sorted relative paths
+    """
+    file_paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if fnmatch.fnmatch(filename, pattern):
+                file_paths.append(os.path.relpath(os.path.join(dirpath, filename), root))
+    return sorted(file_paths)
+
+def format_throughput(chunks, tokens, seconds):
+    seconds = max(seconds, 1e-9)
+    return f"{chunks} chunks, {tokens} tokens in {seconds:.1f}s " \
+        f"({chunks / seconds:.1f} chunks/sec, {tokens / seconds:.0f} tokens/sec)"
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the knowledge base from a local directory.")
+    parser.add_argument("directory", help="Directory to index, e.g. docs/")
+    parser.add_argument("--root", default=".", help="Repository root that source_file paths are relative to")
+    parser.add_argument("--pattern", default="*.markdown", help="File name glob to index")
+    parser.add_argument("--table", default=os.environ.get("TABLE_NAME"), help="Embeddings table")
+    parser.add_argument("--checkpoint", default=".kb_index_checkpoint.json", help="Progress file used to resume")
+    parser.add_argument("--files-per-batch", type=int, default=20,
+                        help="Files indexed between checkpoints")
+    parser.add_argument("--reset", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--openai-base-url", default=os.environ.get("OPENAI_BASE_URL"),
+                        help="OpenAI-compatible endpoint, e.g. a local stand-in")
+    parser.add_argument("--supabase-url", default=os.environ.get("SUPABASE_URL"),
+                        help="Supabase URL, e.g. a local Supabase stack")
+    parser.add_argument("--supabase-key", default=os.environ.get("SUPABASE_KEY"))
+    parser.add_argument("--embedding-cache", default=os.environ.get("EMBEDDING_CACHE", ""),
+                        help='Embedding cache, e.g. "sqlite:.kb_embedding_cache.db"')
+    args = parser.parse_args()
+
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), base_url=args.openai_base_url)
+    supabase = create_client(args.supabase_url, args.supabase_key)
+    cache = get_embedding_cache(supabase, args.embedding_cache)
+
+    checkpoint = {'completed': [], 'stats': {'chunks': 0, 'tokens': 0, 'seconds': 0.0}} \
+        if args.reset else load_checkpoint(args.checkpoint)
+    completed = set(checkpoint['completed'])
+    file_paths = [path for path in find_files(args.directory, args.root, args.pattern) if path not in completed]
+    print(f"{len(completed)} files already indexed, {len(file_paths)} to go")
+
+    def read_local(file_path):
+        # Stream the file like a download so large files are never read whole
+        with open(os.path.join(args.root, file_path), encoding='utf-8') as f:
+            yield from iter_text_lines(iter(lambda: f.read(STREAM_READ_SIZE), ''))
+
+    run_chunks = run_tokens = 0
+    run_start = time.time()
+    for start in range(0, len(file_paths), args.files_per_batch):
+        batch = file_paths[start:start + args.files_per_batch]
+        batch_start = time.time()
+
+        # 'update' diffs against stored chunks, so re-running a batch that was
+        # interrupted half-way only embeds what is missing
+        writer = ChunkWriter(supabase, args.table, generation=new_generation())
+        failed = index_files(client, supabase, "", [(path, "update") for path in batch], args.table,
+                             writer, cache, loader=read_local)
+        stats = writer.flush()
+
+        # Swap readers over to the group's new chunks; only checkpoint files
+        # whose chunks were all embedded and stored
+        batch_failed = failed_files(failed, writer)
+        publish_generation(supabase, args.table, batch, batch_failed, writer.generation)
+        elapsed = time.time() - batch_start
+        checkpoint['completed'].extend(path for path in batch if path not in batch_failed)
+        checkpoint['stats']['chunks'] += stats['written']
+        checkpoint['stats']['tokens'] += stats['tokens_written']
+        checkpoint['stats']['seconds'] += elapsed
+        save_checkpoint(args.checkpoint, checkpoint)
+
+        run_chunks += stats['written']
+        run_tokens += stats['tokens_written']
+        done = min(start + args.files_per_batch, len(file_paths))
+        print(f"[{done}/{len(file_paths)}] {format_throughput(stats['written'], stats['tokens_written'], elapsed)}"
+              f"{f', {len(batch_failed)} files failed' if batch_failed else ''}")
+
+    if cache is not None:
+        cache.evict()
+        print(f"Embedding cache: {cache.stats()}")
+    print(f"This run: {format_throughput(run_chunks, run_tokens, time.time() - run_start)}")
+    totals = checkpoint['stats']
+    print(f"All runs: {format_throughput(totals['chunks'], totals['tokens'], totals['seconds'])}")
+
+if __name__ == "__main__":
+    main()
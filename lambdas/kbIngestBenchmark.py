@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import threading
+import contextlib
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import requests
+
+from kbPipeline import ChunkWriter, index_files
+
+EMBEDDING_DIMENSIONS = 1536
+
+def generate_markdown(size_bytes):
+    """
+    Generate a markdown document of roughly size_bytes, piece by piece
+
+    Args:
+        size_bytes (int): Approximate document size
+
+    Yields:
+        bytes: Consecutive sections of the document
+    """
+    written = 0
+    section = 0
+    while written < size_bytes:
+        text = f"## Section {section}\n\n" + \
+            " ".join(f"resource{section}_{word}" for word in range(150)) + "\n\n" + \
+            f"```hcl\nresource \"aws_s3_bucket\" \"b{section}\" {{\n  bucket = \"kb-{section}\"\n}}\n```\n\n"
+        data = text.encode('utf-8')
+        written += len(data)
+        section += 1
+        yield data
+
+class DocumentHandler(BaseHTTPRequestHandler):
+    """Serve /<bytes>.markdown as a generated document of that size, without buffering it"""
+
+    def do_GET(self):
+        size_bytes = int(self.path.strip('/').split('.')[0])
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        for data in generate_markdown(size_bytes):
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInEmbeddings:
+    """Return fixed vectors of the real dimension so responses cost as much memory as OpenAI's"""
+
+    def create(self, input, model, encoding_format):
+        inputs = input if isinstance(input, list) else [input]
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=[0.0] * EMBEDDING_DIMENSIONS) for i in range(len(inputs))
+        ])
+
+class StandInTable:
+    """Accept writes and drop them, counting the rows; reads find nothing stored"""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.rows = []
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    upsert = insert
+
+    def select(self, columns):
+        self.rows = []
+        return self
+
+    def in_(self, column, values):
+        return self
+
+    def execute(self):
+        self.counter['rows'] += len(self.rows)
+        return SimpleNamespace(data=[])
+
+class StandInSupabase:
+    def __init__(self):
+        self.counter = {'rows': 0}
+
+    def table(self, name):
+        return StandInTable(self.counter)
+
+def run_once(size_bytes, mode, window):
+    """
+    Index one generated document in this process and report peak memory
+
+    Args:
+        size_bytes (int): Document size
+        mode (str): 'stream' to use the streaming downloader, 'whole' to
+            read the response body in one piece first
+        window (int): INGEST_WINDOW_CHUNKS for the run
+
+    Returns:
+        dict: Chunks written, elapsed seconds and peak RSS in MB
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DocumentHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    raw_base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    supabase = StandInSupabase()
+    client = SimpleNamespace(embeddings=StandInEmbeddings())
+    writer = ChunkWriter(supabase, 'kb_benchmark', generation=1)
+
+    loader = None
+    if mode == 'whole':
+        loader = lambda file_path: requests.get(raw_base_url + file_path, timeout=60).text.splitlines()
+
+    start = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        failed = index_files(client, supabase, raw_base_url, [(f"{size_bytes}.markdown", "add")],
+                             'kb_benchmark', writer, loader=loader, window=window)
+        writer.flush()
+    elapsed = time.time() - start
+    server.shutdown()
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    return {'chunks': supabase.counter['rows'], 'failed': len(failed), 'seconds': elapsed, 'peak_rss_mb': peak_mb}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure peak ingestion memory as file size grows.")
+    parser.add_argument("--sizes-mb", default="1,4,16,64", help="Comma-separated document sizes in MB")
+    parser.add_argument("--mode", choices=["stream", "whole", "both"], default="both",
+                        help="Streaming downloader, whole-body download, or both for comparison")
+    parser.add_argument("--window", type=int, default=int(os.environ.get("INGEST_WINDOW_CHUNKS", "512")),
+                        help="Chunks held between pipeline stages")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_once(args.child, args.mode, args.window)))
+        return
+
+    # Every run gets a fresh process so that peak RSS is not inherited from a larger run
+    modes = ["stream", "whole"] if args.mode == "both" else [args.mode]
+    print(f"{'mode':<8}{'size MB':>9}{'chunks':>9}{'seconds':>9}{'peak RSS MB':>13}")
+    for mode in modes:
+        for size_mb in [float(size) for size in args.sizes_mb.split(',')]:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", str(int(size_mb * 1024 * 1024)), "--mode", mode,
+                 "--window", str(args.window)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:<8}{size_mb:>9g}{result['chunks']:>9}{result['seconds']:>9.1f}{result['peak_rss_mb']:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1497 @@
+import os
+import json
+import requests
+from supabase import create_client
+from openai import OpenAI, BadRequestError
+import hashlib
+import re
+import time
+import sqlite3
+import queue
+import threading
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Upper bounds for a single embeddings request. OpenAI accepts up to 2048 inputs
+# and ~300k tokens per call; stay comfortably below both by default.
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "200000"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "3"))
+
+# Chunk size bounds in tokens. Sections that would overflow the current chunk
+# start a new one, unless it still holds fewer than CHUNK_MIN_TOKENS.
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "1000"))
+CHUNK_MIN_TOKENS = int(os.environ.get("CHUNK_MIN_TOKENS", "200"))
+
+HCL_EXTENSIONS = ('.tf', '.hcl', '.tfvars')
+
+# Maximum number of rows sent to Supabase in one bulk upsert. Each row
+# carries a 1536-float embedding, so keep request bodies at a few MB.
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "100"))
+
+# Generation-versioned indexing. Every chunk row carries first_generation and
+# retired_generation, and VERSIONS_TABLE (source_file primary key, generation)
+# holds the committed generation of each file. Readers such as match_docs must
+# only return chunks visible at the committed generation:
+#
+#   LEFT JOIN kb_file_versions v USING (source_file)
+#   WHERE first_generation <= COALESCE(v.generation, 0)
+#     AND (retired_generation IS NULL OR retired_generation > COALESCE(v.generation, 0))
+VERSIONS_TABLE = os.environ.get("VERSIONS_TABLE", "kb_file_versions")
+
+# Page size for reads and maximum ids per set-membership delete
+READ_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 200
+
+# Concurrency limits for the ingestion pipeline stages
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "8"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+WRITE_CONCURRENCY = int(os.environ.get("WRITE_CONCURRENCY", "2"))
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", "30"))
+
+# Push webhook payloads list at most PUSH_PAYLOAD_MAX_COMMITS commits; longer
+# pushes are also diffed with the compare API, which lists at most
+# COMPARE_MAX_FILES files. GITHUB_TOKEN is optional for public repositories but
+# raises the API rate limit.
+PUSH_PAYLOAD_MAX_COMMITS = 2048
+COMPARE_MAX_FILES = 300
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
+
+# Files are streamed rather than loaded whole. INGEST_WINDOW_CHUNKS caps the
+# chunks held between stages (queued for embedding plus in flight), which
+# bounds peak memory independently of file size.
+INGEST_WINDOW_CHUNKS = int(os.environ.get("INGEST_WINDOW_CHUNKS", "512"))
+STREAM_READ_SIZE = 64 * 1024
+MAX_BLOCK_CHARS = CHUNK_MAX_TOKENS * 8
+
+# Embedding cache backend: "sqlite:<path>" for a local file, "table:<name>" for
+# a Supabase table, or empty to disable caching. SQLite entries are float32
+# blobs of ~6 KB, so the default cap keeps the file around 300 MB, within
+# Lambda's default 512 MB of /tmp.
+EMBEDDING_CACHE = os.environ.get("EMBEDDING_CACHE", "")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+except Exception:
+    # tiktoken is optional; fall back to a rough characters-per-token estimate
+    _encoding = None
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+FENCE_RE = re.compile(r'^\s*(```|~~~)')
+HCL_BLOCK_RE = re.compile(r'^[A-Za-z_][\w-]*(\s+("[^"]*"|[\w-]+))*\s*\{\s*$')
+
+def _block(text, path, level=0, fence=None):
+    return {'text': text, 'path': path, 'level': level, 'fence': fence}
+
+def iter_text_lines(pieces, max_line_chars=STREAM_READ_SIZE):
+    """
+    Split a stream of text pieces into lines without reading it all at once
+    
+    Lines longer than max_line_chars are yielded in max_line_chars pieces so
+    that a file without newlines cannot grow the buffer without bound.
+    
+    Args:
+        pieces (iterable): Text pieces, e.g. decoded HTTP response chunks
+        max_line_chars (int): Longest line kept in memory
+    
+    Yields:
+        str: Lines, without their line endings
+    """
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        lines = buffer.split('\n')
+        buffer = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+        while len(buffer) > max_line_chars:
+            yield buffer[:max_line_chars]
+            buffer = buffer[max_line_chars:]
+    if buffer:
+        yield buffer.rstrip('\r')
+
+def parse_markdown_blocks(lines, max_block_chars=MAX_BLOCK_CHARS):
+    """
+    Split markdown into headings, fenced code blocks and paragraphs
+    
+    Args:
+        lines (iterable): Lines of the markdown document
+        max_block_chars (int): Paragraphs and code blocks longer than this are
+            emitted in pieces, bounding the memory used per block
+    
+    Yields:
+        dict: Blocks with 'text', 'path' (heading titles leading to the
+            block), 'level' (heading level, 0 for non-headings) and 'fence'
+            (the fence marker for code blocks)
+    """
+    headings = []
+    paragraph = []
+    paragraph_chars = 0
+    code = None
+    code_chars = 0
+    fence = None
+    front_matter = None
+
+    def path():
+        return tuple(title for _, title in headings)
+
+    for line in lines:
+        # Drop YAML front matter; the page title is repeated in the first heading
+        if front_matter is None:
+            front_matter = line.strip() == '---'
+            if front_matter:
+                continue
+        elif front_matter:
+            front_matter = line.strip() != '---'
+            continue
+
+        if code is not None:
+            code.append(line)
+            code_chars += len(line) + 1
+            if line.strip() == fence:
+                yield _block('\n'.join(code), path(), fence=fence)
+                code = None
+            elif code_chars > max_block_chars:
+                # Close the fence here and reopen it for the rest of the block
+                yield _block('\n'.join(code + [fence]), path(), fence=fence)
+                code = [code[0]]
+                code_chars = len(code[0])
+            continue
+        opening = FENCE_RE.match(line)
+        if opening:
+            if paragraph:
+                yield _block('\n'.join(paragraph), path())
+                paragraph = []
+                paragraph_chars = 0
+            code = [line]
+            code_chars = len(line)
+            fence = opening.group(1)
+            continue
+        heading = HEADING_RE.match(line)
+        if heading or not line.strip():
+            if paragraph:
+                yield _block('\n'.join(paragraph), path())
+                paragraph = []
+                paragraph_chars = 0
+        if heading:
+            level = len(heading.group(1))
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, heading.group(2)))
+            yield _block(line, path(), level=level)
+        elif line.strip():
+            paragraph.append(line)
+            paragraph_chars += len(line) + 1
+            if paragraph_chars > max_block_chars:
+                yield _block('\n'.join(paragraph), path())
+                paragraph = []
+                paragraph_chars = 0
+    if paragraph:
+        yield _block('\n'.join(paragraph), path())
+    if code is not None:
+        # Unterminated fence: keep the code as a plain block
+        yield _block('\n'.join(code), path())
+
+def parse_hcl_blocks(lines, max_block_chars=MAX_BLOCK_CHARS):
+    """
+    Split HCL into top-level blocks (resource, module, variable, ...)
+    
+    Comments and blank lines before a block are kept with it.
+    
+    Args:
+        lines (iterable): Lines of the HCL document
+        max_block_chars (int): Blocks longer than this are emitted in pieces
+    
+    Yields:
+        dict: Blocks in the same shape as parse_markdown_blocks
+    """
+    current = []
+    current_chars = 0
+    header = None
+    continued = False
+    for line in lines:
+        current.append(line)
+        current_chars += len(line) + 1
+        if header is None and HCL_BLOCK_RE.match(line):
+            header = line.rstrip('{ ').strip()
+        elif header is not None and line.rstrip() == '}':
+            yield _block('\n'.join(current).strip('\n'), (header,), level=0 if continued else 1)
+            current = []
+            current_chars = 0
+            header = None
+            continued = False
+        elif current_chars > max_block_chars:
+            yield _block('\n'.join(current).strip('\n'), (header,) if header else (),
+                         level=1 if header and not continued else 0)
+            current = []
+            current_chars = 0
+            continued = header is not None
+    if '\n'.join(current).strip():
+        yield _block('\n'.join(current).strip('\n'), (header,) if header else ())
+
+def split_oversized_block(block, max_tokens):
+    """
+    Split a block that is larger than max_tokens on line boundaries
+    
+    Code blocks are re-fenced so that every piece is valid markdown.
+    
+    Args:
+        block (dict): Block from parse_markdown_blocks or parse_hcl_blocks
+        max_tokens (int): Token budget per piece
+    
+    Returns:
+        list: Blocks that each fit within max_tokens where possible
+    """
+    if count_tokens(block['text']) <= max_tokens:
+        return [block]
+
+    lines = block['text'].split('\n')
+    opening = closing = ''
+    if block['fence'] and len(lines) > 2:
+        opening, closing = lines[0], lines[-1]
+        lines = lines[1:-1]
+    # Leave room for the fence lines and the heading path prefix
+    budget = max_tokens - count_tokens(opening + closing + ' > '.join(block['path'])) - 4
+
+    # Hard-wrap single lines that are over budget on their own
+    wrapped = []
+    for line in lines:
+        if count_tokens(line) > budget:
+            width = budget * 3
+            wrapped.extend(line[i:i + width] for i in range(0, len(line), width))
+        else:
+            wrapped.append(line)
+
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in wrapped:
+        tokens = count_tokens(line) + 1
+        if current and current_tokens + tokens > budget:
+            pieces.append(current)
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        pieces.append(current)
+
+    blocks = []
+    for i, piece in enumerate(pieces):
+        text = '\n'.join(piece)
+        if opening:
+            text = f"{opening}\n{text}\n{closing}"
+        # Only the first piece keeps the heading level so that the rest are
+        # packed as continuations of the same section
+        blocks.append(_block(text, block['path'], block['level'] if i == 0 else 0, block['fence']))
+    return blocks
+
+def _chunk(chunk_pieces):
+    first = chunk_pieces[0][0]
+    texts = [piece['text'] for piece, _ in chunk_pieces]
+    if not first['level'] and first['path']:
+        texts.insert(0, ' > '.join(first['path']))
+    return {'content': '\n\n'.join(texts), 'heading_path': ' > '.join(first['path'])}
+
+def pack_blocks(blocks, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS):
+    """
+    Pack consecutive blocks into chunks bounded by max_tokens
+    
+    Whole sections are kept together where possible: a heading of level 1 or 2
+    starts a new chunk when its section would not fit in the current one
+    (unless the current chunk is still under min_tokens), and a heading is
+    never left dangling at the end of a chunk. Chunks that start in the middle
+    of a section are prefixed with their heading path for context.
+    
+    Blocks are consumed lazily; at most about one chunk's worth of blocks is
+    read ahead to size the next section.
+    
+    Args:
+        blocks (iterable): Parsed blocks, in document order
+        max_tokens (int): Token budget per chunk
+        min_tokens (int): Size below which sections are merged
+    
+    Yields:
+        dict: Chunks with 'content' and 'heading_path'
+    """
+    # One extra token per piece for the blank line joining blocks
+    pieces = ((piece, count_tokens(piece['text']) + 1)
+              for block in blocks for piece in split_oversized_block(block, max_tokens))
+    lookahead = deque()
+
+    def section_fits(level, budget):
+        # Read ahead until the section ends or grows past the budget
+        size = 0
+        i = 0
+        while True:
+            if i == len(lookahead):
+                following = next(pieces, None)
+                if following is None:
+                    return True
+                lookahead.append(following)
+            following, following_tokens = lookahead[i]
+            if 0 < following['level'] <= level:
+                return True
+            size += following_tokens
+            if size > budget:
+                return False
+            i += 1
+
+    current = []
+    current_tokens = 0
+    while True:
+        item = lookahead.popleft() if lookahead else next(pieces, None)
+        if item is None:
+            break
+        piece, tokens = item
+        if current and (current_tokens + tokens > max_tokens or (
+                0 < piece['level'] <= 2 and current_tokens >= min_tokens
+                and not section_fits(piece['level'], max_tokens - current_tokens - tokens))):
+            # Carry trailing headings over to the chunk they introduce
+            carried = []
+            while len(current) > 1 and current[-1][0]['level']:
+                carried.insert(0, current.pop())
+            yield _chunk(current)
+            current = carried
+            current_tokens = sum(carried_tokens for _, carried_tokens in carried)
+        if not current and not piece['level'] and piece['path']:
+            current_tokens += count_tokens(' > '.join(piece['path'])) + 1
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        yield _chunk(current)
+
+def iter_chunks(lines, source_file="", max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS):
+    """
+    Lazily split a stream of lines into structure-aware chunks
+    
+    Args:
+        lines (iterable): Lines of the document
+        source_file (str): File name, used to pick the parser
+        max_tokens (int): Token budget per chunk
+        min_tokens (int): Size below which sections are merged
+    
+    Yields:
+        dict: Chunks with 'content' and 'heading_path'
+    """
+    if source_file.endswith(HCL_EXTENSIONS):
+        blocks = parse_hcl_blocks(lines)
+    else:
+        blocks = parse_markdown_blocks(lines)
+    return pack_blocks(blocks, max_tokens, min_tokens)
+
+def generate_unique_hash(content, source_file, occurrence=0):
+    """
+    Generate a deterministic, content-addressed hash for a document chunk
+    
+    The chunk position is deliberately left out so that a chunk keeps its id
+    when an edit earlier in the file shifts it to a different index.
+    
+    Args:
+        content (str): The text content of the chunk
+        source_file (str): The source file name
+        occurrence (int): How many identical chunks precede this one in the file
+    
+    Returns:
+        str: A unique hash identifier
+    """
+    hash_input = f"{content}|{source_file}|{occurrence}"
+    return hashlib.sha256(hash_input.encode('utf-8')).hexdigest()
+
+def hash_file_chunks(chunks, source_file):
+    """
+    Build chunk records with content-addressed ids for one file
+    
+    Args:
+        chunks (iterable): Chunks from iter_chunks, in order
+        source_file (str): The source file name
+    
+    Yields:
+        dict: Records with 'id', 'source_file', 'chunk_index', 'content' and
+            'heading_path'
+    """
+    # Count occurrences by digest so that chunk text is not kept around
+    seen = Counter()
+    for i, chunk in enumerate(chunks):
+        content = chunk['content']
+        digest = content_hash(content)
+        yield {
+            'id': generate_unique_hash(content, source_file, seen[digest]),
+            'source_file': source_file,
+            'chunk_index': i,
+            'content': content,
+            'heading_path': chunk['heading_path']
+        }
+        seen[digest] += 1
+
+def count_tokens(text):
+    """
+    Count (or estimate, when tiktoken is unavailable) the tokens in a text
+    
+    Args:
+        text (str): Input text
+    
+    Returns:
+        int: Number of tokens
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+def batch_chunks(chunk_records, max_inputs=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_BATCH_TOKENS):
+    """
+    Pack chunk records from any number of files into embedding batches
+    
+    Args:
+        chunk_records (list): Dicts with 'source_file', 'chunk_index' and 'content'
+        max_inputs (int): Maximum number of inputs per batch
+        max_tokens (int): Maximum total tokens per batch
+    
+    Yields:
+        list: A batch of chunk records
+    """
+    batch = []
+    batch_tokens = 0
+    for record in chunk_records:
+        tokens = record.get('tokens') or count_tokens(record['content'])
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _create_embeddings(client, inputs):
+    """
+    Call the embeddings endpoint, retrying transient errors with exponential backoff
+    
+    Rate limits, timeouts and server errors are retried. A BadRequestError
+    (an input the API rejects) is raised at once, since retrying cannot fix it.
+    
+    Args:
+        client: OpenAI client instance
+        inputs (str or list): Text or texts to embed
+    
+    Returns:
+        The embeddings response
+    """
+    for attempt in range(EMBEDDING_MAX_RETRIES):
+        try:
+            return client.embeddings.create(
+                input=inputs,
+                model=EMBEDDING_MODEL,
+                encoding_format="float"
+            )
+        except BadRequestError:
+            raise
+        except Exception as e:
+            if attempt == EMBEDDING_MAX_RETRIES - 1:
+                raise
+            print(f"Embedding attempt {attempt + 1} failed, retrying: {e}")
+            time.sleep(2 ** attempt)
+
+def _embed_single(client, record):
+    """
+    Embed one chunk on its own
+    
+    Args:
+        client: OpenAI client instance
+        record (dict): Chunk record to embed
+    
+    Returns:
+        list: The embedding vector, or None if it could not be embedded
+    """
+    try:
+        return _create_embeddings(client, record['content']).data[0].embedding
+    except Exception as e:
+        print(f"Failed to embed chunk {record['chunk_index']} of {record['source_file']}: {e}")
+        return None
+
+def embed_batch(client, batch):
+    """
+    Embed a batch of chunks with a single request
+    
+    Transient failures retry the whole batch. If the API rejects the request
+    (BadRequestError) the batch is bisected so that only the offending chunks
+    end up being sent on their own; inputs missing from an otherwise
+    successful response are retried individually as well. A batch that still
+    fails after its retries is reported as failed without being split, so an
+    outage costs a few requests per batch rather than one per chunk.
+    
+    Args:
+        client: OpenAI client instance
+        batch (list): Chunk records to embed
+    
+    Returns:
+        tuple: (dict mapping (source_file, chunk_index) to embedding, list of failed keys)
+    """
+    if len(batch) == 1:
+        record = batch[0]
+        key = (record['source_file'], record['chunk_index'])
+        embedding = _embed_single(client, record)
+        if embedding is None:
+            return {}, [key]
+        return {key: embedding}, []
+
+    try:
+        response = _create_embeddings(client, [record['content'] for record in batch])
+    except BadRequestError as e:
+        print(f"Embedding batch of {len(batch)} chunks was rejected, splitting: {e}")
+        middle = len(batch) // 2
+        left_embedded, left_failed = embed_batch(client, batch[:middle])
+        right_embedded, right_failed = embed_batch(client, batch[middle:])
+        left_embedded.update(right_embedded)
+        return left_embedded, left_failed + right_failed
+    except Exception as e:
+        print(f"Embedding batch of {len(batch)} chunks failed: {e}")
+        return {}, [(record['source_file'], record['chunk_index']) for record in batch]
+
+    embedded = {}
+    for item in response.data:
+        record = batch[item.index]
+        embedded[(record['source_file'], record['chunk_index'])] = item.embedding
+
+    failed = []
+    for record in batch:
+        key = (record['source_file'], record['chunk_index'])
+        if key not in embedded:
+            embedding = _embed_single(client, record)
+            if embedding is None:
+                failed.append(key)
+            else:
+                embedded[key] = embedding
+    return embedded, failed
+
+def content_hash(content):
+    """
+    Hash chunk text independently of the file it came from
+    
+    Args:
+        content (str): The text content of the chunk
+    
+    Returns:
+        str: Hex digest identifying the content
+    """
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Base class for embedding caches keyed by (model, content hash).
+    
+    Backends implement _get_many, _put_many and evict; this class keeps the
+    hit/miss counters shared by all of them.
+    """
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, model, hashes):
+        """
+        Look up cached embeddings
+        
+        Args:
+            model (str): Embedding model name
+            hashes (list): Content hashes to look up
+        
+        Returns:
+            dict: Content hash to embedding for every hit
+        """
+        hashes = list(set(hashes))
+        if not hashes:
+            return {}
+        try:
+            found = self._get_many(model, hashes)
+        except Exception as e:
+            print(f"Embedding cache lookup failed: {e}")
+            found = {}
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model, embeddings):
+        """
+        Store embeddings, evicting the least recently used entries when full
+        
+        Args:
+            model (str): Embedding model name
+            embeddings (dict): Content hash to embedding
+        """
+        if not embeddings:
+            return
+        try:
+            self._put_many(model, embeddings)
+        except Exception as e:
+            print(f"Embedding cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """Embedding cache in a local SQLite file, for offline and CLI runs. Embeddings are stored as float32."""
+
+    def __init__(self, path, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        super().__init__(max_entries)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "model TEXT NOT NULL, content_hash TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (model, content_hash))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embedding_cache_last_used ON embedding_cache (last_used)")
+        self.conn.commit()
+
+    def _get_many(self, model, hashes):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT content_hash, embedding FROM embedding_cache "
+                    f"WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model] + batch
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = array('f', blob).tolist()
+                self.conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND content_hash = ?",
+                    [(now, model, content_hash) for content_hash, _ in rows]
+                )
+            self.conn.commit()
+        return found
+
+    def _put_many(self, model, embeddings):
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (model, content_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+                [(model, content_hash, array('f', embedding).tobytes(), now)
+                 for content_hash, embedding in embeddings.items()]
+            )
+            self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM embedding_cache WHERE rowid IN "
+                    "(SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                self.conn.commit()
+
+class SupabaseEmbeddingCache(EmbeddingCache):
+    """
+    Embedding cache in a Supabase table with columns model, content_hash,
+    embedding and last_used (primary key on model, content_hash).
+    
+    Eviction runs once per invocation via evict() rather than on every write.
+    """
+
+    def __init__(self, supabase, table_name, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        super().__init__(max_entries)
+        self.supabase = supabase
+        self.table_name = table_name
+
+    def _get_many(self, model, hashes):
+        found = {}
+        for start in range(0, len(hashes), DELETE_BATCH_SIZE):
+            batch = hashes[start:start + DELETE_BATCH_SIZE]
+            response = self.supabase.table(self.table_name).select('content_hash, embedding') \
+                .eq('model', model).in_('content_hash', batch).execute()
+            for row in response.data:
+                embedding = row['embedding']
+                # pgvector columns come back as their text representation
+                found[row['content_hash']] = json.loads(embedding) if isinstance(embedding, str) else embedding
+        if found:
+            self.supabase.table(self.table_name).update({'last_used': time.time()}) \
+                .eq('model', model).in_('content_hash', list(found)).execute()
+        return found
+
+    def _put_many(self, model, embeddings):
+        now = time.time()
+        rows = [
+            {'model': model, 'content_hash': content_hash, 'embedding': embedding, 'last_used': now}
+            for content_hash, embedding in embeddings.items()
+        ]
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            self.supabase.table(self.table_name).upsert(rows[start:start + WRITE_BATCH_SIZE]).execute()
+
+    def evict(self):
+        try:
+            while True:
+                response = self.supabase.table(self.table_name).select('model, content_hash') \
+                    .order('last_used', desc=True) \
+                    .range(self.max_entries, self.max_entries + DELETE_BATCH_SIZE - 1).execute()
+                if not response.data:
+                    return
+                # One set-membership delete per model on the page
+                by_model = {}
+                for row in response.data:
+                    by_model.setdefault(row['model'], []).append(row['content_hash'])
+                for model, hashes in by_model.items():
+                    self.supabase.table(self.table_name).delete() \
+                        .eq('model', model).in_('content_hash', hashes).execute()
+        except Exception as e:
+            print(f"Embedding cache eviction failed: {e}")
+
+def get_embedding_cache(supabase, spec=EMBEDDING_CACHE):
+    """
+    Build the embedding cache described by spec
+    
+    Args:
+        supabase: Supabase client instance, used by the table backend
+        spec (str): "sqlite:<path>", "table:<name>" or empty
+    
+    Returns:
+        EmbeddingCache: The cache, or None when caching is disabled
+    """
+    if not spec:
+        return None
+    backend, _, location = spec.partition(":")
+    if backend == "sqlite":
+        return SQLiteEmbeddingCache(location or "/tmp/embedding_cache.db")
+    if backend == "table":
+        return SupabaseEmbeddingCache(supabase, location or "embedding_cache")
+    raise ValueError(f"Unknown embedding cache backend: {backend}")
+
+def embed_batch_cached(client, batch, cache=None):
+    """
+    Embed a batch of chunks and store the new embeddings in the cache
+    
+    Args:
+        client: OpenAI client instance
+        batch (list): Chunk records to embed
+        cache (EmbeddingCache): Optional cache to populate
+    
+    Returns:
+        tuple: (dict mapping (source_file, chunk_index) to embedding, list of failed keys)
+    """
+    embedded, failed = embed_batch(client, batch)
+    if cache is not None:
+        cache.put_many(EMBEDDING_MODEL, {
+            content_hash(record['content']): embedded[(record['source_file'], record['chunk_index'])]
+            for record in batch
+            if (record['source_file'], record['chunk_index']) in embedded
+        })
+    return embedded, failed
+
+class ChunkWriter:
+    """
+    Buffer chunk rows across files and write them to Supabase in bulk.
+    
+    Rows are grouped by operation ('add' or 'update') and each group is
+    flushed whenever it reaches batch_size rows. Both are upserted: ids are
+    content-addressed, so a redelivered push or a file the bulk indexer
+    already stored rewrites the same rows instead of failing the batch. Full
+    batches are written on a small thread pool (at most max_workers in flight)
+    so writes overlap with downloading and embedding; pass max_workers=0 to
+    write inline.
+    Call flush() once all files have been processed to write whatever is left
+    in the buffers.
+    
+    New rows are written under `generation` and rows they replace are only
+    marked as retired in that generation, so nothing changes for readers until
+    publish_generation() commits it. Rows whose id is already stored keep their
+    stored first_generation, so rolling the generation back never deletes
+    them.
+    """
+
+    def __init__(self, supabase, TABLE_NAME, generation=0, batch_size=WRITE_BATCH_SIZE, max_workers=WRITE_CONCURRENCY):
+        self.supabase = supabase
+        self.table_name = TABLE_NAME
+        self.generation = generation
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers else None
+        self._futures = set()
+        self._lock = threading.Lock()
+        self.buffers = {"add": [], "update": []}
+        self.pending_retirements = []
+        self.batches = []
+        self.written = 0
+        self.tokens_written = 0
+        self.retired = 0
+        self.failed_rows = []
+
+    def add(self, data, operation="add"):
+        """
+        Queue a row, flushing its buffer when full
+        
+        Args:
+            data (dict): Row to write
+            operation (str): 'add' or 'update'
+        """
+        # Rows without a first_generation get one when they are written
+        data.setdefault('retired_generation', None)
+        buffer = self.buffers[operation]
+        buffer.append(data)
+        if len(buffer) >= self.batch_size:
+            self._flush_operation(operation)
+
+    def retire(self, ids):
+        """
+        Queue rows to be retired in this generation once all buffered rows
+        have been written
+        
+        Args:
+            ids (list): Ids of rows that are no longer part of their file
+        """
+        self.pending_retirements.extend(ids)
+
+    def _flush_operation(self, operation):
+        rows = self.buffers[operation]
+        if not rows:
+            return
+        self.buffers[operation] = []
+        if self._executor is None:
+            self._write_rows(operation, rows)
+            return
+        # Bound the number of bulk writes in flight
+        if len(self._futures) >= self.max_workers:
+            done, self._futures = wait(self._futures, return_when=FIRST_COMPLETED)
+        self._futures.add(self._executor.submit(self._write_rows, operation, rows))
+
+    def _stamp_generation(self, rows):
+        # Ids are content-addressed, so a row can already be stored: a moved
+        # chunk whose embedding could not be read, a file re-embedded because
+        # its stored chunks could not be listed, or a redelivered push. Those
+        # keep their stored first_generation; only new rows get this one.
+        ids = [row['id'] for row in rows if 'first_generation' not in row]
+        stored = {}
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            response = self.supabase.table(self.table_name).select('id, first_generation') \
+                .in_('id', ids[start:start + DELETE_BATCH_SIZE]).execute()
+            stored.update((row['id'], row['first_generation']) for row in response.data)
+        for row in rows:
+            if 'first_generation' not in row:
+                row['first_generation'] = stored.get(row['id'], self.generation)
+
+    def _write_rows(self, operation, rows):
+        try:
+            self._stamp_generation(rows)
+            self.supabase.table(self.table_name).upsert(rows).execute()
+            tokens = sum(count_tokens(row['content']) for row in rows)
+            with self._lock:
+                self.written += len(rows)
+                self.tokens_written += tokens
+                self.batches.append({"operation": operation, "succeeded": len(rows), "failed": 0})
+            print(f"{operation.capitalize()}ed {len(rows)} embeddings in bulk")
+        except Exception as e:
+            with self._lock:
+                self.failed_rows.extend((row['source_file'], row['chunk_index']) for row in rows)
+                self.batches.append({"operation": operation, "succeeded": 0, "failed": len(rows)})
+            print(f"Failed to {operation} batch of {len(rows)} embeddings: {e}")
+            for row in rows:
+                print(f"Not stored: chunk {row['chunk_index']} of {row['source_file']}")
+
+    def flush(self):
+        """
+        Write every buffered row
+        
+        Returns:
+            dict: Per-batch and total success/failure counts
+        """
+        for operation in self.buffers:
+            self._flush_operation(operation)
+        wait(self._futures)
+        self._futures = set()
+
+        ids = self.pending_retirements
+        self.pending_retirements = []
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[start:start + DELETE_BATCH_SIZE]
+            try:
+                self.supabase.table(self.table_name).update({'retired_generation': self.generation}) \
+                    .in_('id', batch).execute()
+                self.retired += len(batch)
+            except Exception as e:
+                print(f"Failed to retire {len(batch)} stale chunks: {e}")
+        return self.stats()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "written": self.written,
+            "tokens_written": self.tokens_written,
+            "retired": self.retired,
+            "failed": len(self.failed_rows)
+        }
+
+def delete_embeddings_for_files(supabase, file_paths, TABLE_NAME):
+    """
+    Remove embeddings for specific files from Supabase.
+    
+    Args:
+        supabase: Supabase client instance
+        file_paths (list): List of file paths whose embeddings need to be removed
+    """
+    file_paths = list(file_paths)
+    for start in range(0, len(file_paths), DELETE_BATCH_SIZE):
+        batch = file_paths[start:start + DELETE_BATCH_SIZE]
+        try:
+            supabase.table(TABLE_NAME).delete().in_('source_file', batch).execute()
+            supabase.table(VERSIONS_TABLE).delete().in_('source_file', batch).execute()
+            print(f"Removed embeddings for files: {', '.join(batch)}")
+        except Exception as e:
+            print(f"Failed to remove embeddings for {', '.join(batch)}: {e}")
+
+def new_generation():
+    """
+    Pick the generation for an indexing run
+    
+    Millisecond timestamps keep generations increasing across runs, including
+    runs that overlap.
+    
+    Returns:
+        int: Generation number
+    """
+    return int(time.time() * 1000)
+
+def retire_file_chunks(supabase, TABLE_NAME, file_paths, generation):
+    """
+    Retire every live chunk of the given files in a generation.
+    
+    Args:
+        supabase: Supabase client instance
+        TABLE_NAME (str): Embeddings table
+        file_paths (list): Files whose chunks are all being replaced
+        generation (int): Generation that replaces them
+    """
+    supabase.table(TABLE_NAME).update({'retired_generation': generation}) \
+        .in_('source_file', list(file_paths)).is_('retired_generation', 'null') \
+        .lt('first_generation', generation).execute()
+
+def failed_files(failed, writer):
+    """
+    Collect the files that have chunks which were not embedded or not stored
+    
+    Args:
+        failed (list): (source_file, chunk_index) keys returned by index_files
+        writer (ChunkWriter): Writer used for the run, after flush()
+    
+    Returns:
+        set: File paths
+    """
+    return {source_file for source_file, _ in failed} | \
+        {source_file for source_file, _ in writer.failed_rows}
+
+def publish_generation(supabase, TABLE_NAME, file_paths, failed_paths, generation):
+    """
+    Commit a generation for files that were fully indexed and roll it back
+    for the rest.
+    
+    Committing is a single-row update per file in VERSIONS_TABLE, so readers
+    switch from the old chunks to the new ones at once. Chunks retired by the
+    committed generation are garbage-collected afterwards.
+    
+    Args:
+        supabase: Supabase client instance
+        TABLE_NAME (str): Embeddings table
+        file_paths (list): Files indexed in this generation
+        failed_paths (set): Files with chunks that could not be embedded or stored
+        generation (int): Generation to publish
+    
+    Returns:
+        dict: Lists of committed and rolled back files
+    """
+    committed = [path for path in file_paths if path not in failed_paths]
+    rolled_back = [path for path in file_paths if path in failed_paths]
+
+    for start in range(0, len(committed), DELETE_BATCH_SIZE):
+        batch = committed[start:start + DELETE_BATCH_SIZE]
+        try:
+            # First-time files get a version row; existing rows only move forward
+            supabase.table(VERSIONS_TABLE).upsert(
+                [{'source_file': path, 'generation': generation} for path in batch],
+                ignore_duplicates=True
+            ).execute()
+            supabase.table(VERSIONS_TABLE).update({'generation': generation}) \
+                .in_('source_file', batch).lt('generation', generation).execute()
+        except Exception as e:
+            print(f"Failed to commit generation {generation} for {', '.join(batch)}: {e}")
+            continue
+        try:
+            supabase.table(TABLE_NAME).delete().in_('source_file', batch) \
+                .lte('retired_generation', generation).execute()
+        except Exception as e:
+            # Retired chunks stay invisible; the next run collects them
+            print(f"Failed to garbage-collect retired chunks for {', '.join(batch)}: {e}")
+
+    for start in range(0, len(rolled_back), DELETE_BATCH_SIZE):
+        batch = rolled_back[start:start + DELETE_BATCH_SIZE]
+        try:
+            supabase.table(TABLE_NAME).delete().in_('source_file', batch) \
+                .eq('first_generation', generation).execute()
+            supabase.table(TABLE_NAME).update({'retired_generation': None}).in_('source_file', batch) \
+                .eq('retired_generation', generation).execute()
+        except Exception as e:
+            print(f"Failed to roll back generation {generation} for {', '.join(batch)}: {e}")
+
+    print(f"Generation {generation}: committed {len(committed)} files, rolled back {len(rolled_back)}")
+    return {"committed": committed, "rolled_back": rolled_back}
+
+def compare_commits(repo_name, before, after):
+    """
+    Get the net change set between two commits from the GitHub compare API.
+    
+    Renamed files count as removed under their old path and added under the
+    new one.
+    
+    Args:
+        repo_name (str): Repository full name, e.g. "owner/repo"
+        before (str): Commit the push started from
+        after (str): Commit the push ended at
+    
+    Returns:
+        tuple: ({file path: "added", "modified" or "removed"}, whether the
+        file list was cut off at COMPARE_MAX_FILES)
+    """
+    headers = {"Accept": "application/vnd.github+json"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    response = requests.get(f"{GITHUB_API_URL}/repos/{repo_name}/compare/{before}...{after}",
+                            headers=headers, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    files = response.json().get("files", [])
+
+    changes = {}
+    for changed in files:
+        status = changed["status"]
+        if status in ("added", "copied"):
+            changes[changed["filename"]] = "added"
+        elif status == "removed":
+            changes[changed["filename"]] = "removed"
+        elif status == "renamed":
+            changes[changed["previous_filename"]] = "removed"
+            changes[changed["filename"]] = "added"
+        elif status != "unchanged":
+            changes[changed["filename"]] = "modified"
+    return changes, len(files) >= COMPARE_MAX_FILES
+
+def coalesce_commits(body):
+    """
+    Merge every commit of a push payload into one net change set.
+    
+    A file added and then modified within the push counts as added, a file
+    added and then removed is dropped, and a file removed and re-added counts
+    as modified. Payloads only list the first PUSH_PAYLOAD_MAX_COMMITS
+    commits, so longer pushes are diffed with compare_commits(); when its
+    file list is cut off, the files the listed commits name are kept too.
+    
+    Args:
+        body (dict): GitHub push webhook payload
+    
+    Returns:
+        tuple: (added, modified, removed) lists of file paths
+    """
+    commits = body.get("commits") or [commit for commit in [body.get("head_commit")] if commit]
+    changes = {}
+    for commit in commits:
+        for file_path in commit.get("added", []):
+            changes[file_path] = "modified" if changes.get(file_path) == "removed" else "added"
+        for file_path in commit.get("modified", []):
+            changes[file_path] = "added" if changes.get(file_path) == "added" else "modified"
+        for file_path in commit.get("removed", []):
+            if changes.get(file_path) == "added":
+                # Never existed before this push, so nothing was indexed
+                del changes[file_path]
+            else:
+                changes[file_path] = "removed"
+
+    before = body.get("before") or ""
+    if len(commits) >= PUSH_PAYLOAD_MAX_COMMITS and before.strip("0") and body.get("after"):
+        try:
+            compared, truncated = compare_commits(body["repository"]["full_name"], before, body["after"])
+            if truncated:
+                # The compare API is authoritative for the files it lists
+                print(f"Compare {before[:7]}...{body['after'][:7]} lists only {COMPARE_MAX_FILES} files, "
+                      f"merging it with the listed commits")
+                changes.update(compared)
+            else:
+                changes = compared
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to compare {before[:7]}...{body['after'][:7]}, using the listed commits only: {e}")
+
+    added = [path for path, change in changes.items() if change == "added"]
+    modified = [path for path, change in changes.items() if change == "modified"]
+    removed = [path for path, change in changes.items() if change == "removed"]
+    return added, modified, removed
+
+def fetch_stored_chunks(supabase, TABLE_NAME, file_paths, columns='id, source_file, chunk_index'):
+    """
+    Read the live (not retired) chunk rows for a set of files.
+    
+    Args:
+        supabase: Supabase client instance
+        TABLE_NAME (str): Embeddings table
+        file_paths (list): Files whose rows should be read
+        columns (str): Columns to select
+    
+    Returns:
+        list: Stored rows
+    """
+    rows = []
+    if not file_paths:
+        return rows
+    start = 0
+    while True:
+        response = supabase.table(TABLE_NAME).select(columns).in_('source_file', list(file_paths)) \
+            .is_('retired_generation', 'null').range(start, start + READ_PAGE_SIZE - 1).execute()
+        rows.extend(response.data)
+        if len(response.data) < READ_PAGE_SIZE:
+            return rows
+        start += READ_PAGE_SIZE
+
+def reuse_stored_embeddings(supabase, TABLE_NAME, records):
+    """
+    Attach stored embeddings to chunk records whose content is unchanged.
+    
+    Args:
+        supabase: Supabase client instance
+        TABLE_NAME (str): Embeddings table
+        records (list): Chunk records whose id already exists in the table
+    
+    Returns:
+        tuple: (rows ready to write, records whose embedding could not be read)
+    """
+    rows = []
+    missing = []
+    for start in range(0, len(records), DELETE_BATCH_SIZE):
+        batch = records[start:start + DELETE_BATCH_SIZE]
+        try:
+            response = supabase.table(TABLE_NAME).select('id, embedding, first_generation') \
+                .in_('id', [record['id'] for record in batch]).execute()
+            stored = {row['id']: row for row in response.data}
+        except Exception as e:
+            print(f"Failed to read embeddings of moved chunks, re-embedding them: {e}")
+            stored = {}
+        for record in batch:
+            if record['id'] in stored:
+                row = stored[record['id']]
+                rows.append(dict(record, embedding=row['embedding'], first_generation=row['first_generation']))
+            else:
+                missing.append(record)
+    return rows, missing
+
+def stream_file(raw_base_url, file_path):
+    """
+    Download a file from the repository as a stream of lines
+    
+    The response body is read in STREAM_READ_SIZE pieces, so the whole file is
+    never held in memory.
+    
+    Args:
+        raw_base_url (str): Base URL for raw files
+        file_path (str): Path of the file in the repository
+    
+    Yields:
+        str: Lines of the file
+    """
+    raw_url = raw_base_url + file_path
+    response = requests.get(raw_url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    try:
+        response.raise_for_status()
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        yield from iter_text_lines(response.iter_content(chunk_size=STREAM_READ_SIZE, decode_unicode=True))
+    finally:
+        response.close()
+
+def stream_file_records(supabase, raw_base_url, file_path, TABLE_NAME, ingest, operation="add", loader=None,
+                        generation=0):
+    """
+    Stream one file through the chunker onto the ingest queue.
+    
+    On update, records are diffed against the stored chunks as they are
+    produced: only chunks whose content changed are queued for embedding,
+    chunks that only moved get their stored embedding back and chunks that
+    disappeared are reported once the whole file has been read. Putting onto
+    the bounded queue blocks, which throttles reading to the embedding rate.
+    
+    Items put on the queue:
+        ('embed', record): a chunk that needs an embedding
+        ('ready', row): a moved chunk, with its stored embedding
+        ('done', file_path, stale_ids): the file was read completely
+        ('failed', file_path): the file could not be read (completely)
+    
+    Exactly one 'done' or 'failed' item is put per file.
+    
+    Args:
+        supabase: Supabase client instance
+        raw_base_url (str): Base URL for raw files
+        file_path (str): File to process
+        TABLE_NAME (str): Embeddings table
+        ingest (queue.Queue): Bounded queue read by index_files
+        operation (str): 'add' or 'update'
+        loader (callable): Optional function returning the lines of a file
+            path, used instead of downloading it from raw_base_url
+        generation (int): Generation being indexed
+    """
+    finished = False
+    try:
+        stored = None
+        if operation == "update":
+            try:
+                stored = {row['id']: row['chunk_index']
+                          for row in fetch_stored_chunks(supabase, TABLE_NAME, [file_path])}
+            except Exception as e:
+                print(f"Failed to read stored chunks for {file_path}, re-embedding all: {e}")
+                retire_file_chunks(supabase, TABLE_NAME, [file_path], generation)
+
+        def put_moved(records):
+            # Re-index chunks that only moved, reusing their stored embedding
+            ready_rows, missing = reuse_stored_embeddings(supabase, TABLE_NAME, records)
+            for row in ready_rows:
+                ingest.put(('ready', row))
+            for record in missing:
+                ingest.put(('embed', record))
+
+        lines = stream_file(raw_base_url, file_path) if loader is None else loader(file_path)
+        seen = set()
+        moved = []
+        changed = moved_count = 0
+        for record in hash_file_chunks(iter_chunks(lines, file_path), file_path):
+            if stored is None or record['id'] not in stored:
+                changed += 1
+                ingest.put(('embed', record))
+            elif stored[record['id']] != record['chunk_index']:
+                moved_count += 1
+                moved.append(record)
+                if len(moved) >= DELETE_BATCH_SIZE:
+                    put_moved(moved)
+                    moved = []
+            seen.add(record['id'])
+        if moved:
+            put_moved(moved)
+
+        # Chunks that disappeared are only retired once the file was read completely
+        stale_ids = [row_id for row_id in stored if row_id not in seen] if stored else []
+        if stored is not None:
+            print(f"{file_path}: {changed} changed, {moved_count} moved and {len(stale_ids)} removed chunks")
+        ingest.put(('done', file_path, stale_ids))
+        finished = True
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to download file {file_path}: {e}")
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+    finally:
+        if not finished:
+            ingest.put(('failed', file_path))
+
+def index_files(client, supabase, raw_base_url, jobs, TABLE_NAME, writer, cache=None, loader=None,
+                download_workers=DOWNLOAD_CONCURRENCY, embed_workers=EMBED_CONCURRENCY,
+                window=INGEST_WINDOW_CHUNKS):
+    """
+    Run the download -> chunk -> embed -> write pipeline over many files.
+    
+    Files are streamed and chunked on one thread pool, embedding batches are
+    sent on a second pool as soon as enough chunks have arrived, and embedded
+    rows go to the writer, which runs bulk writes on its own pool. Chunks are
+    handed between stages through a queue of at most `window` items and at
+    most `window` chunks are waiting for or being embedded, so peak memory
+    does not depend on file size.
+    
+    Args:
+        client: OpenAI client instance
+        supabase: Supabase client instance
+        raw_base_url (str): Base URL for raw files
+        jobs (list): (file_path, operation) pairs
+        TABLE_NAME (str): Embeddings table
+        writer (ChunkWriter): Writer that receives embedded rows
+        cache (EmbeddingCache): Optional cache checked before calling OpenAI
+        loader (callable): Optional file reader used instead of downloading
+        download_workers (int): Files streamed concurrently
+        embed_workers (int): Embedding requests in flight
+        window (int): Chunks held between stages
+    
+    Returns:
+        list: (source_file, chunk_index) keys that could not be embedded;
+            chunk_index is None for files that could not be read
+    """
+    operations = dict(jobs)
+    pending_jobs = iter(jobs)
+    failed = []
+    ingest = queue.Queue(maxsize=window)
+    # Keep every embedding worker busy without exceeding the window
+    batch_size = max(1, min(EMBEDDING_BATCH_SIZE, window // embed_workers))
+    streaming = 0
+    in_flight = 0
+
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ThreadPoolExecutor(max_workers=embed_workers) as embeds:
+        embedding = {}
+
+        def schedule_downloads():
+            nonlocal streaming
+            while streaming < download_workers:
+                job = next(pending_jobs, None)
+                if job is None:
+                    return
+                downloads.submit(stream_file_records, supabase, raw_base_url, job[0], TABLE_NAME, ingest,
+                                 job[1], loader, writer.generation)
+                streaming += 1
+
+        def collect_embeddings(limit):
+            # Hand finished batches to the writer, waiting until at most
+            # `limit` chunks are in flight
+            nonlocal in_flight
+            while embedding:
+                done = {future for future in embedding if future.done()}
+                if not done:
+                    if in_flight <= limit:
+                        return
+                    done, _ = wait(embedding, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = embedding.pop(future)
+                    in_flight -= len(batch)
+                    embedded, batch_failed = future.result()
+                    failed.extend(batch_failed)
+                    for record in batch:
+                        key = (record['source_file'], record['chunk_index'])
+                        if key in embedded:
+                            writer.add(dict(record, embedding=embedded[key]), operations[record['source_file']])
+                    print(f"Embedded batch of {len(batch)} chunks ({len(batch_failed)} failed)")
+
+        def lookup_cache(records):
+            # Chunks already embedded anywhere (renamed, reverted or shared
+            # content) skip the OpenAI call
+            if cache is None or not records:
+                return records
+            cached = cache.get_many(EMBEDDING_MODEL, [content_hash(record['content']) for record in records])
+            misses = []
+            for record in records:
+                cached_embedding = cached.get(content_hash(record['content']))
+                if cached_embedding is None:
+                    misses.append(record)
+                else:
+                    writer.add(dict(record, embedding=cached_embedding), operations[record['source_file']])
+            return misses
+
+        def records_to_embed():
+            # Drain the ingest queue until every file has been read, yielding
+            # the chunks that still need an embedding
+            nonlocal streaming
+            unchecked = []
+            schedule_downloads()
+            while streaming:
+                item = ingest.get()
+                if item[0] == 'embed':
+                    unchecked.append(item[1])
+                elif item[0] == 'ready':
+                    writer.add(item[1], operations[item[1]['source_file']])
+                else:
+                    streaming -= 1
+                    if item[0] == 'done':
+                        writer.retire(item[2])
+                    else:
+                        failed.append((item[1], None))
+                    schedule_downloads()
+                    collect_embeddings(window)
+                if unchecked and (len(unchecked) >= batch_size or ingest.empty()):
+                    yield from lookup_cache(unchecked)
+                    unchecked = []
+            yield from lookup_cache(unchecked)
+
+        for batch in batch_chunks(records_to_embed(), max_inputs=batch_size):
+            collect_embeddings(window - len(batch))
+            embedding[embeds.submit(embed_batch_cached, client, batch, cache)] = batch
+            in_flight += len(batch)
+        collect_embeddings(0)
+
+    return failed
+
+def handle_push(event):
+    """
+    Re-index the files a GitHub push webhook changed.
+    
+    This is the whole of the embeddingFn and kbDataProcessor Lambdas; both
+    are packaged with this module.
+    
+    Args:
+        event (dict): API Gateway event carrying the push payload as its body
+    
+    Returns:
+        dict: API Gateway response
+    """
+    print(event)
+    # Set up API keys and Supabase client
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),  # This is the default and can be omitted
+    )    
+    supabase = create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY"))
+    TABLE_NAME = os.environ.get("TABLE_NAME")
+
+    # Parse the webhook payload
+    body = json.loads(event["body"])
+    repo_name = body["repository"]["full_name"]
+    commit_id = body["head_commit"]["id"]
+    added_files, modified_files, removed_files = coalesce_commits(body)
+    print(f"Net changes: {len(added_files)} added, {len(modified_files)} modified, {len(removed_files)} removed")
+
+    # Base URL for raw files
+    raw_base_url = f"https://raw.githubusercontent.com/{repo_name}/{commit_id}/"
+
+    # Remove embeddings for removed files
+    delete_embeddings_for_files(supabase, removed_files, TABLE_NAME)
+
+    # Rows are buffered and written in bulk under a new generation, which
+    # readers only see once it is published below
+    generation = new_generation()
+    writer = ChunkWriter(supabase, TABLE_NAME, generation=generation)
+    cache = get_embedding_cache(supabase)
+
+    # Add embeddings for added files and update embeddings for modified files
+    # (re-embedding only changed chunks) in one overlapping pipeline
+    jobs = [(file_path, "add") for file_path in added_files] + \
+        [(file_path, "update") for file_path in modified_files]
+    failed = index_files(client, supabase, raw_base_url, jobs, TABLE_NAME, writer, cache)
+    for source_file, chunk_index in failed:
+        if chunk_index is not None:
+            print(f"Failed to embed chunk {chunk_index} of {source_file}")
+
+    # Write whatever is still buffered
+    write_stats = writer.flush()
+    print(f"Stored {write_stats['written']} chunks, {write_stats['failed']} failed")
+
+    # Atomically switch readers to the new chunks of every fully indexed file
+    publication = publish_generation(
+        supabase, TABLE_NAME, added_files + modified_files, failed_files(failed, writer), generation)
+
+    cache_stats = None
+    if cache is not None:
+        cache.evict()
+        cache_stats = cache.stats()
+        print(f"Embedding cache: {cache_stats}")
+
+    return {
+        "statusCode": 200 if not write_stats['failed'] else 500,
+        "body": json.dumps({
+            "message": "Processed added, modified, and removed files",
+            "writes": write_stats,
+            "generation": generation,
+            "rolled_back": publication["rolled_back"],
+            "embedding_cache": cache_stats
+        })
+    }
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+# chatbotLF creates its clients at import time; point them at harmless values
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from chatbotLF import CHAT_MODEL, WebSocketForwarder, stream_completion
+
+def generate_response(resources, trailing_words):
+    """Completion text: a short preamble, a ```hcl block and an explanation after it"""
+    blocks = "\n\n".join(
+        f'resource "aws_security_group" "sg_{i}" {{\n'
+        f'  name        = "sg-{i}"\n'
+        f'  description = "Allow HTTPS"\n'
+        f'  ingress {{\n    from_port   = 443\n    to_port     = 443\n    protocol    = "tcp"\n'
+        f'    cidr_blocks = ["0.0.0.0/0"]\n  }}\n}}'
+        for i in range(resources)
+    )
+    explanation = " ".join(["This template creates the requested security groups."] * (trailing_words // 7 + 1))
+    return f"Here is the Terraform template:\n\n```hcl\n{blocks}\n```\n\n{explanation}"
+
+def tokenize(text):
+    # Roughly the size of model tokens
+    return re.findall(r"\s*\S{1,4}|\s+", text)
+
+class FakeWebSocket:
+    """post_to_connection that takes post_delay seconds, like an API Gateway round trip"""
+
+    def __init__(self, post_delay):
+        self.post_delay = post_delay
+        self.messages = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        time.sleep(self.post_delay)
+        self.messages.append(json.loads(Data)['partial'])
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible /v1/chat/completions that emits one token every token_delay seconds"""
+
+    text = ""
+    token_delay = 0.005
+    first_token_delay = 0.3
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        tokens = tokenize(self.text)
+        time.sleep(self.first_token_delay)
+        if not request.get('stream'):
+            time.sleep(self.token_delay * len(tokens))
+            body = json.dumps({
+                "id": "chatcmpl-benchmark", "object": "chat.completion", "created": int(time.time()),
+                "model": request['model'],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.text},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for token in tokens + [None]:
+                chunk = {
+                    "id": "chatcmpl-benchmark", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": request['model'],
+                    "choices": [{"index": 0, "delta": {"content": token} if token else {},
+                                 "finish_reason": None if token else "stop"}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if token:
+                    time.sleep(self.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading after the closing fence
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare streamed and blocking RAG generation against a local fake.")
+    parser.add_argument("--resources", type=int, default=5, help="Resource blocks in the generated template")
+    parser.add_argument("--trailing-words", type=int, default=150, help="Words of explanation after the block")
+    parser.add_argument("--token-delay-ms", type=float, default=5, help="Delay between streamed tokens")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Delay before the first token")
+    parser.add_argument("--post-ms", type=float, default=30, help="Round trip of one WebSocket post")
+    args = parser.parse_args()
+
+    FakeCompletionHandler.text = generate_response(args.resources, args.trailing_words)
+    FakeCompletionHandler.token_delay = args.token_delay_ms / 1000
+    FakeCompletionHandler.first_token_delay = args.first_token_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    chat_client = OpenAI(api_key="benchmark", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    messages = [{"role": "user", "content": "Create a security group that allows HTTPS"}]
+    expected = re.search(r"```hcl\n(.*?)\n```", FakeCompletionHandler.text, re.DOTALL).group(1).strip()
+
+    start = time.perf_counter()
+    response = chat_client.chat.completions.create(model=CHAT_MODEL, messages=messages)
+    match = re.search(r"```hcl\n(.*?)\n```", response.choices[0].message.content, re.DOTALL)
+    blocking = time.perf_counter() - start
+    assert match and match.group(1).strip() == expected
+
+    pieces = []
+    payload, _, timings = stream_completion(messages, on_delta=pieces.append, chat_client=chat_client)
+    assert payload == expected, "streamed payload differs from the blocking one"
+    assert "".join(pieces).strip() == expected, "forwarded pieces do not add up to the payload"
+
+    # Posting each piece from the read loop, as a plain callback would
+    websocket = FakeWebSocket(args.post_ms / 1000)
+    forward = lambda text: websocket.post_to_connection(ConnectionId="benchmark", Data=json.dumps({'partial': text}))
+    _, _, inline_timings = stream_completion(messages, on_delta=forward, chat_client=chat_client)
+    inline_posts = len(websocket.messages)
+
+    websocket = FakeWebSocket(args.post_ms / 1000)
+    start = time.perf_counter()
+    with WebSocketForwarder("benchmark", websocket) as forward:
+        _, _, forwarded_timings = stream_completion(messages, on_delta=forward, chat_client=chat_client)
+    delivered = time.perf_counter() - start
+    assert "".join(websocket.messages).strip() == expected, "posted messages do not add up to the payload"
+    server.shutdown()
+
+    print(f"{len(tokenize(FakeCompletionHandler.text))} tokens, {len(expected)} payload characters")
+    print(f"blocking:  first byte {blocking * 1000:7.0f} ms, payload ready {blocking * 1000:7.0f} ms")
+    print(f"streaming: first byte {timings['first_payload'] * 1000:7.0f} ms, "
+          f"payload ready {timings['fence_closed'] * 1000:7.0f} ms "
+          f"(first token {timings['first_token'] * 1000:.0f} ms, {len(pieces)} forwarded pieces)")
+    print(f"posting each piece ({args.post_ms:.0f} ms per post): payload ready "
+          f"{inline_timings['fence_closed'] * 1000:7.0f} ms, {inline_posts} messages")
+    print(f"background forwarder: payload ready {forwarded_timings['fence_closed'] * 1000:7.0f} ms, "
+          f"all delivered {delivered * 1000:7.0f} ms, {len(websocket.messages)} messages")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("TABLE_NAME", "result_key_mapping")
+
+import sqsConsumer_notifications as consumer
+
+class LocalDynamoDB:
+    """
+    In-memory stand-in for the DynamoDB calls the consumer makes, with a fixed
+    per-request latency to model the network round trip
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.tables = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def batch_write_item(self, RequestItems):
+        self._call()
+        with self._lock:
+            for table_name, requests in RequestItems.items():
+                table = self.tables.setdefault(table_name, {})
+                for request in requests:
+                    item = request['PutRequest']['Item']
+                    table[next(iter(item.values()))['S']] = item
+        return {'UnprocessedItems': {}}
+
+    def batch_get_item(self, RequestItems):
+        self._call()
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.tables.get(table_name, {})
+            responses[table_name] = [table[key['key_id']['S']] for key in request['Keys'] if key['key_id']['S'] in table]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+def make_output(deployment, mapped_keys, unmapped_keys):
+    """Terraform output JSON as the deployment runner posts it, with percent-encoded spaces and newlines"""
+    outputs = {}
+    for i in range(mapped_keys):
+        outputs[f"ec2_public_ip_{deployment}_{i}"] = {"sensitive": False, "type": "string", "value": "10.0.0.1"}
+    for i in range(unmapped_keys):
+        outputs[f"vpc_id_{deployment}_{i}"] = {"sensitive": False, "type": "string", "value": "vpc-0abc"}
+    text = json.dumps(outputs, indent=2).replace('\n', '%0A').replace(' ', '%20')
+    return f"::debug::stdout:{text}::debug::stderr:"
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure SQS consumer throughput by batch size.")
+    parser.add_argument("--messages", type=int, default=200, help="Messages processed per batch size")
+    parser.add_argument("--batch-sizes", default="1,10,100", help="Comma-separated SQS batch sizes")
+    parser.add_argument("--mapped-keys", type=int, default=3, help="Outputs per message with a key mapping")
+    parser.add_argument("--unmapped-keys", type=int, default=10, help="Outputs per message without one")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Simulated DynamoDB round trip")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    table_name = os.environ["TABLE_NAME"]
+    print(f"{'batch size':>10}{'messages/s':>12}{'DynamoDB requests':>19}{'failed':>8}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        dynamodb = LocalDynamoDB(args.latency_ms / 1000)
+        consumer.dynamodb = dynamodb
+        records = []
+        for deployment in range(args.messages):
+            for i in range(args.mapped_keys):
+                dynamodb.tables.setdefault(table_name, {})[f"ec2_public_ip_{deployment}_{i}"] = {
+                    'key_id': {'S': f"ec2_public_ip_{deployment}_{i}"},
+                    'user_id': {'S': "user@example.com"},
+                    'session_id': {'S': str(uuid.uuid4())}
+                }
+            records.append({'messageId': str(uuid.uuid4()),
+                            'body': make_output(deployment, args.mapped_keys, args.unmapped_keys)})
+
+        failed = 0
+        start = time.perf_counter()
+        for offset in range(0, len(records), batch_size):
+            response = consumer.lambda_handler({'Records': records[offset:offset + batch_size]}, None)
+            failed += len(response['batchItemFailures'])
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>10}{len(records) / elapsed:>12.1f}{dynamodb.requests:>19}{failed:>8}")
+
+if __name__ == "__main__":
+    main()
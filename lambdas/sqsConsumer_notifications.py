@@ -1,8 +1,16 @@
+import os
 import json
+import time
+import random
 import logging
+import threading
+import functools
+from collections import OrderedDict
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
 
 # Set up logging
 logger = logging.getLogger()
@@ -11,37 +19,167 @@ logger.setLevel(logging.INFO)
 # Initialize DynamoDB client
 dynamodb = boto3.client('dynamodb')
 
-def get_all_key_mappings():
-    """Get all entries from result_key_mapping table."""
+# Key mappings are read with BatchGetItem, which takes at most 100 keys per call
+BATCH_GET_SIZE = 100
+MAX_BATCH_RETRIES = 5
+
+# Resources are written to terraform_resources with BatchWriteItem, which takes
+# at most 25 items per call
+RESOURCES_TABLE = 'terraform_resources'
+BATCH_WRITE_SIZE = 25
+
+# Write errors that can clear up on redelivery. Anything else, such as a
+# ValidationException or a client-side ParamValidationError, fails the same
+# way every time.
+TRANSIENT_ERROR_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException',
+                         'RequestLimitExceeded', 'InternalServerError'}
+
+# Key mappings never change once written, so they are cached across warm
+# invocations. Set KEY_MAPPING_CACHE_SIZE=0 to disable the cache.
+KEY_MAPPING_CACHE_SIZE = int(os.environ.get("KEY_MAPPING_CACHE_SIZE", "10000"))
+KEY_MAPPING_CACHE_TTL = int(os.environ.get("KEY_MAPPING_CACHE_TTL", "3600"))
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "InfraPilot/Notifications")
+
+STDOUT_MARKER = "::debug::stdout:"
+STDERR_MARKER = "::debug::stderr:"
+
+# Escapes the deployment runner writes into workflow command output. '%'
+# itself is sent as %25 and decoded last, so an escaped escape stays literal.
+# A str.replace per escape is several times faster than one unquote() pass.
+WORKFLOW_ESCAPES = (('%0A', '\n'), ('%20', ' '), ('%0D', '\r'), ('%25', '%'))
+
+# Records of one SQS batch processed concurrently
+RECORD_CONCURRENCY = int(os.environ.get("RECORD_CONCURRENCY", "8"))
+
+class KeyMappingCache:
+    """key_id -> {'user_id', 'session_id'} kept across warm invocations, LRU-bounded and expiring after ttl."""
+
+    def __init__(self, max_entries=KEY_MAPPING_CACHE_SIZE, ttl=KEY_MAPPING_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, key_ids):
+        """Returns (cached mappings, key_ids that have to be read)."""
+        found = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for key_id in key_ids:
+                entry = self.entries.get(key_id)
+                if entry is None or entry[0] < now:
+                    self.entries.pop(key_id, None)
+                    missing.append(key_id)
+                else:
+                    self.entries.move_to_end(key_id)
+                    found[key_id] = entry[1]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, mappings):
+        if not self.max_entries:
+            return
+        expires = time.time() + self.ttl
+        with self._lock:
+            for key_id, mapping in mappings.items():
+                self.entries[key_id] = (expires, mapping)
+                self.entries.move_to_end(key_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key_ids):
+        with self._lock:
+            for key_id in key_ids:
+                self.entries.pop(key_id, None)
+
+key_mapping_cache = KeyMappingCache()
+
+def emit_cache_metrics(hits, misses):
+    """Log key-mapping cache counts in CloudWatch embedded metric format."""
+    lookups = hits + misses
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [[]],
+                'Metrics': [
+                    {'Name': 'KeyMappingCacheHits', 'Unit': 'Count'},
+                    {'Name': 'KeyMappingCacheMisses', 'Unit': 'Count'},
+                    {'Name': 'KeyMappingCacheHitRate', 'Unit': 'Percent'}
+                ]
+            }]
+        },
+        'KeyMappingCacheHits': hits,
+        'KeyMappingCacheMisses': misses,
+        'KeyMappingCacheHitRate': 100.0 * hits / lookups if lookups else 0.0
+    }))
+
+def get_key_mappings(key_ids):
+    """Look up the result_key_mapping entries of the given keys, from the cache or with batched point reads."""
+    key_ids = list(dict.fromkeys(key_ids))  # BatchGetItem rejects duplicate keys
+    mappings, missing = key_mapping_cache.get_many(key_ids)
+    if missing:
+        fetched = read_key_mappings(missing)
+        key_mapping_cache.put_many(fetched)
+        mappings.update(fetched)
+    return mappings
+
+def apply_key_mapping_changes(records):
+    """
+    Keep the key-mapping cache in step with a DynamoDB Streams feed of the result_key_mapping table.
+    Only the instance that receives the stream batch is updated; the TTL bounds staleness elsewhere.
+    """
+    for record in records:
+        keys = record['dynamodb'].get('Keys', {})
+        key_id = keys.get('key_id', {}).get('S')
+        if not key_id:
+            continue
+        image = record['dynamodb'].get('NewImage')
+        if record['eventName'] == 'REMOVE' or not image:
+            key_mapping_cache.invalidate([key_id])
+        else:
+            key_mapping_cache.put_many({key_id: {
+                'user_id': image['user_id']['S'],
+                'session_id': image['session_id']['S']
+            }})
+    logger.info(f"Applied {len(records)} key mapping changes to the cache")
+
+def read_key_mappings(key_ids):
+    """Read result_key_mapping entries with batched point reads."""
+    table_name = os.environ.get("TABLE_NAME")
+    mappings = {}
     try:
-        response = dynamodb.scan(
-            TableName=os.environ.get("TABLE_NAME")
-        )
-        
-        mappings = {}
-        for item in response.get('Items', []):
-            key_id = item['key_id']['S']
-            mappings[key_id] = {
-                'user_id': item['user_id']['S'],
-                'session_id': item['session_id']['S']
-            }
-        
-        # Handle pagination if there are more results
-        while 'LastEvaluatedKey' in response:
-            response = dynamodb.scan(
-                TableName=os.environ.get("TABLE_NAME"),
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-            for item in response.get('Items', []):
-                key_id = item['key_id']['S']
-                mappings[key_id] = {
-                    'user_id': item['user_id']['S'],
-                    'session_id': item['session_id']['S']
+        for start in range(0, len(key_ids), BATCH_GET_SIZE):
+            request = {
+                table_name: {
+                    'Keys': [{'key_id': {'S': key_id}} for key_id in key_ids[start:start + BATCH_GET_SIZE]],
+                    'ProjectionExpression': 'key_id, user_id, session_id'
                 }
-                
+            }
+            for attempt in range(MAX_BATCH_RETRIES + 1):
+                response = dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(table_name, []):
+                    mappings[item['key_id']['S']] = {
+                        'user_id': item['user_id']['S'],
+                        'session_id': item['session_id']['S']
+                    }
+
+                # Retry keys DynamoDB did not get to (throttling, size limits)
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                if attempt == MAX_BATCH_RETRIES:
+                    raise RuntimeError(f"{len(request[table_name]['Keys'])} key mappings still unprocessed after {MAX_BATCH_RETRIES} retries")
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
         return mappings
     except ClientError as e:
-        logger.error(f"Error scanning result-key-mapping table: {str(e)}")
+        logger.error(f"Error reading result-key-mapping table: {str(e)}")
         raise
 
 def parse_rds_value(value):
@@ -69,51 +207,95 @@ def parse_rds_value(value):
         logger.error(f"Error parsing RDS value: {str(e)}")
         return {'endpoint': str(value)}  # Fallback to treating entire value as endpoint
 
-def parse_terraform_output(output_str, key_mappings):
-    """Parse terraform output and find matching resources from key mappings."""
+# Output key classification. Rules are tried in order and the first one with a
+# match string in the lowercased key gives the resource type. Keys differ
+# mostly in their numeric suffix, so each key with the suffix removed is
+# classified once and the result reused. Each attribute is
+# (name, strings the key must contain for the output value to be copied, or
+# None to always copy it, whether to set it to None when the key has none of
+# them). A parser turns the value into extra fields; credentials it finds mark
+# the resource as sensitive.
+RESOURCE_RULES = (
+    {'type': 'ec2', 'match': ('ec2',), 'attributes': (('ip_address', ('ip',), True),)},
+    {'type': 'ecs', 'match': ('ecs',), 'attributes': (('dns_name', ('dns', 'alb'), False),)},
+    {'type': 'rds', 'match': ('rds',), 'parser': parse_rds_value},
+    {'type': 'loadbalancer', 'match': ('lb', 'loadbalancer'), 'attributes': (('dns_name', None, True),)},
+    {'type': 'ssh_key', 'match': ('key', 'private_key')},
+)
+
+RESOURCE_CLASSIFIER = tuple(
+    (rule['type'], tuple(rule['match']), tuple(rule.get('attributes', ())), rule.get('parser'))
+    for rule in RESOURCE_RULES
+)
+
+def load_terraform_output(output_str):
+    """Extract the terraform output JSON from an SQS message body, undo its percent-encoding and parse it."""
+    start = output_str.find(STDOUT_MARKER)
+    if start != -1:
+        start += len(STDOUT_MARKER)
+        end = output_str.find(STDERR_MARKER, start)
+        output_str = output_str[start:end if end != -1 else len(output_str)].strip()
+    
+    for escape, char in WORKFLOW_ESCAPES:
+        if '%' not in output_str:
+            break
+        output_str = output_str.replace(escape, char)
     try:
-        if "::debug::stdout:" in output_str:
-            output_str = output_str.split("::debug::stdout:")[1].split("::debug::stderr:")[0].strip()
-        
-        output_str = output_str.replace('%0A', '\n').replace('%20', ' ')
         data = json.loads(output_str)
-        
+        if not isinstance(data, dict):
+            raise json.JSONDecodeError("Expecting a JSON object", output_str, 0)
+        return data
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse JSON: {str(e)}")
+        logger.error(f"Problematic output string: {output_str}")
+        raise
+
+@functools.lru_cache(maxsize=4096)
+def classify_key(shape):
+    """(type, attributes set to the value, attributes set to None, parser) for an output key without its numeric suffix."""
+    lowered = shape.lower()
+    for resource_type, strings, attributes, parser in RESOURCE_CLASSIFIER:
+        if any(string in lowered for string in strings):
+            copied = tuple(name for name, attribute_strings, _ in attributes
+                           if attribute_strings is None or any(string in lowered for string in attribute_strings))
+            cleared = tuple(name for name, _, set_none in attributes if set_none and name not in copied)
+            return resource_type, copied, cleared, parser
+    return 'unknown', (), (), None
+
+def parse_terraform_output(outputs, key_mappings):
+    """Build resource records for the terraform outputs (key, output) that have key mappings."""
+    try:
         matching_resources = []
         
         # Check each terraform output against our key mappings
-        for key, value in data.items():
-            if key in key_mappings:
-                resource_info = {
-                    'name': key,
-                    'type': 'unknown',
-                    'value': value.get('value'),
-                    'sensitive': value.get('sensitive', False),
-                    'data_type': value.get('type'),
-                    'timestamp': key.split('_')[-1] if key.split('_')[-1].isdigit() else None,
-                    'user_id': key_mappings[key]['user_id'],
-                    'session_id': key_mappings[key]['session_id']
-                }
-
-                # Determine resource type and add specific attributes
-                if 'ec2' in key.lower():
-                    resource_info['type'] = 'ec2'
-                    resource_info['ip_address'] = value.get('value') if 'ip' in key.lower() else None
-                elif 'ecs' in key.lower():
-                    resource_info['type'] = 'ecs'
-                    if 'dns' in key.lower() or 'alb' in key.lower():
-                        resource_info['dns_name'] = value.get('value')
-                elif 'rds' in key.lower():
-                    resource_info['type'] = 'rds'
-                    rds_details = parse_rds_value(value.get('value'))
-                    resource_info.update(rds_details)
-                    resource_info['sensitive'] = bool(rds_details.get('username') or rds_details.get('password'))
-                elif 'lb' in key.lower() or 'loadbalancer' in key.lower():
-                    resource_info['type'] = 'loadbalancer'
-                    resource_info['dns_name'] = value.get('value')
-                elif 'key' in key.lower() or 'private_key' in key.lower():
-                    resource_info['type'] = 'ssh_key'
-                
-                matching_resources.append(resource_info)
+        for key, output in outputs:
+            mapping = key_mappings.get(key)
+            if mapping is None:
+                continue
+            value = output.get('value')
+            suffix = key.rpartition('_')[2]
+            is_timestamp = suffix.isdigit()
+            # Cutting the digits after the last '_' cannot change which strings the key contains
+            resource_type, copied, cleared, parser = classify_key(key[:-len(suffix)] if is_timestamp else key)
+            resource_info = {
+                'name': key,
+                'type': resource_type,
+                'value': value,
+                'sensitive': output.get('sensitive', False),
+                'data_type': output.get('type'),
+                'timestamp': suffix if is_timestamp else None,
+                'user_id': mapping['user_id'],
+                'session_id': mapping['session_id']
+            }
+            for name in copied:
+                resource_info[name] = value
+            for name in cleared:
+                resource_info[name] = None
+            if parser is not None:
+                details = parser(value)
+                resource_info.update(details)
+                resource_info['sensitive'] = bool(details.get('username') or details.get('password'))
+            matching_resources.append(resource_info)
         
         if not matching_resources:
             logger.info("No matching resources found in key mappings")
@@ -129,16 +311,87 @@ def parse_terraform_output(output_str, key_mappings):
             }
         }
         
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse JSON: {str(e)}")
-        logger.error(f"Problematic output string: {output_str}")
-        raise
     except Exception as e:
         logger.error(f"Error processing terraform output: {str(e)}")
         raise
     
-def store_resource_data(resource_data, user_id, session_id):
-    """Store resource data in DynamoDB results table."""
+class MalformedMessageError(Exception):
+    """A message that retrying cannot fix; it is logged and acknowledged instead of redelivered."""
+
+def is_transient_error(error):
+    """Whether a DynamoDB error is throttling or a connection problem, which a retry can fix."""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+    return isinstance(error, (BotoConnectionError, HTTPClientError))
+
+class ResourceWriter:
+    """
+    Buffer terraform_resources items and write them with BatchWriteItem, 25 at a time.
+    UnprocessedItems are re-sent with exponential backoff. A batch DynamoDB rejects outright is
+    re-sent one item at a time so a single bad item does not sink the others. flush() reports
+    which items were stored, which failed transiently and which were rejected.
+    """
+
+    def __init__(self, table_name=RESOURCES_TABLE, batch_size=BATCH_WRITE_SIZE):
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.pending = []
+        self.stored = []
+        self.failed = []
+        self.rejected = []
+
+    def add(self, name, item):
+        self.pending.append((name, item))
+        if len(self.pending) >= self.batch_size:
+            self._write(self.pending)
+            self.pending = []
+
+    def _write(self, batch):
+        names = {item['deployment_id']['S']: name for name, item in batch}
+        requests = [{'PutRequest': {'Item': item}} for _, item in batch]
+        try:
+            for attempt in range(MAX_BATCH_RETRIES + 1):
+                response = dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                unprocessed_ids = {request['PutRequest']['Item']['deployment_id']['S'] for request in unprocessed}
+                for request in requests:
+                    deployment_id = request['PutRequest']['Item']['deployment_id']['S']
+                    if deployment_id not in unprocessed_ids:
+                        self.stored.append(names[deployment_id])
+                        logger.info(f"Stored resource data for {names[deployment_id]}")
+                requests = unprocessed
+                if not requests:
+                    return
+                if attempt < MAX_BATCH_RETRIES:
+                    time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+            logger.error(f"{len(requests)} resources still unprocessed after {MAX_BATCH_RETRIES} retries")
+        except (ClientError, BotoCoreError) as e:
+            if not is_transient_error(e):
+                remaining = [(names[request['PutRequest']['Item']['deployment_id']['S']], request['PutRequest']['Item'])
+                             for request in requests]
+                if len(remaining) > 1:
+                    for entry in remaining:
+                        self._write([entry])
+                else:
+                    logger.error(f"DynamoDB rejected resource {remaining[0][0]}: {str(e)}")
+                    self.rejected.append(remaining[0][0])
+                return
+            logger.error(f"Error storing data in DynamoDB: {str(e)}")
+        self.failed.extend(names[request['PutRequest']['Item']['deployment_id']['S']] for request in requests)
+
+    def flush(self):
+        """Write what is buffered. Returns the names of the stored, failed and rejected resources."""
+        if self.pending:
+            self._write(self.pending)
+            self.pending = []
+        return self.stored, self.failed, self.rejected
+
+def attribute_string(value):
+    """DynamoDB string form of an output value; lists and maps are stored as JSON."""
+    return value if isinstance(value, str) else json.dumps(value)
+
+def store_resource_data(resource_data, user_id, session_id, writer):
+    """Queue resource data for the DynamoDB results table."""
     try:
         deployment_id = resource_data['name']
         
@@ -156,33 +409,29 @@ def store_resource_data(resource_data, user_id, session_id):
         
         # Add optional fields if they exist
         if resource_data.get('ip_address'):
-            item['ip_address'] = {'S': resource_data['ip_address']}
+            item['ip_address'] = {'S': attribute_string(resource_data['ip_address'])}
         if resource_data.get('dns_name'):
-            item['dns_name'] = {'S': resource_data['dns_name']}
+            item['dns_name'] = {'S': attribute_string(resource_data['dns_name'])}
         if resource_data.get('endpoint'):
-            item['endpoint'] = {'S': resource_data['endpoint']}
+            item['endpoint'] = {'S': attribute_string(resource_data['endpoint'])}
         if resource_data.get('username'):
-            item['username'] = {'S': resource_data['username']}
+            item['username'] = {'S': attribute_string(resource_data['username'])}
         if resource_data.get('password'):
-            item['password'] = {'S': resource_data['password']}
+            item['password'] = {'S': attribute_string(resource_data['password'])}
         
-        dynamodb.put_item(
-            TableName='terraform_resources', 
-            Item=item
-        )
-        logger.info(f"Stored resource data for {resource_data['name']}")
+        writer.add(resource_data['name'], item)
         
-    except ClientError as e:
-        logger.error(f"Error storing data in DynamoDB: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error preparing data for DynamoDB: {str(e)}")
         raise
 
-def process_resource(resource, user_id, session_id):
-    """Process individual resource information."""
+def process_resource(resource, user_id, session_id, writer):
+    """Process individual resource information; it is stored once the writer is flushed."""
     try:
         resource_type = resource['type']
         resource_name = resource['name']
         
-        store_resource_data(resource, user_id, session_id)
+        store_resource_data(resource, user_id, session_id, writer)
 
         if resource['sensitive']:
             logger.info(f"Processed sensitive {resource_type} resource: {resource_name}")
@@ -214,60 +463,131 @@ def process_resource(resource, user_id, session_id):
         logger.error(f"Error processing resource {resource.get('name')}: {str(e)}")
         return False
 
-def lambda_handler(event, context):
-    """Main Lambda handler function."""
-    logger.info("Processing new SQS message")
+def process_record(record):
+    """
+    Process one SQS record. Returns (success, response body); success is False if any resource could
+    not be stored. Raises MalformedMessageError when the terraform output cannot be parsed.
+    """
+    message_body = record['body']
     
+    # Parse the output first so only the keys it names are looked up, a
+    # BatchGetItem's worth at a time; outputs without a mapping are dropped
+    # right away
     try:
-        for record in event['Records']:
-            message_body = record['body']
-            
-            # Get all possible key mappings
-            key_mappings = get_all_key_mappings()
-            if not key_mappings:
-                logger.warning("No key mappings found in result-key-mapping table")
-                continue
-            
-            # Parse output and find matching resources
-            parsed_output = parse_terraform_output(message_body, key_mappings)
-            if not parsed_output:
-                logger.info("No matching resources found for any key mappings")
-                continue
-            
-            success = True
-            processed_resources = []
-            
-            # Process each matching resource
-            for resource in parsed_output['resources']:
-                user_id = resource.pop('user_id')  # Remove from resource dict after getting value
-                session_id = resource.pop('session_id')  # Remove from resource dict after getting value
-                
-                logger.info(f"Processing resource {resource['name']} for user_id: {user_id}, session_id: {session_id}")
-                
-                if not process_resource(resource, user_id, session_id):
-                    success = False
-                else:
-                    processed_resources.append(resource['name'])
-            
-            response_body = {
-                'message': 'Successfully processed all matching resources' if success else 'Some resources failed processing',
-                'processed_resources': processed_resources,
-                'total_processed': len(processed_resources),
-                'contains_sensitive_data': parsed_output['sensitive_data'],
-                'metadata': parsed_output['metadata']
-            }
-            
-            return {
-                'statusCode': 200 if success else 500,
-                'body': json.dumps(response_body)
-            }
-            
+        outputs = load_terraform_output(message_body)
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError
+        raise MalformedMessageError(f"Malformed terraform output: {str(e)}") from e
+    keys = list(outputs)
+    mapped_outputs = []
+    key_mappings = {}
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        found = get_key_mappings(keys[start:start + BATCH_GET_SIZE])
+        key_mappings.update(found)
+        mapped_outputs.extend((key, outputs[key]) for key in keys[start:start + BATCH_GET_SIZE] if key in found)
+    if not key_mappings:
+        logger.warning("No key mappings found in result-key-mapping table")
+        return True, {'message': 'No key mappings found', 'processed_resources': [], 'total_processed': 0}
+    
+    # Find matching resources
+    try:
+        parsed_output = parse_terraform_output(mapped_outputs, key_mappings)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise MalformedMessageError(f"Malformed terraform output: {str(e)}") from e
+    if not parsed_output:
+        logger.info("No matching resources found for any key mappings")
+        return True, {'message': 'No matching resources found', 'processed_resources': [], 'total_processed': 0}
+    
+    success = True
+    skipped_resources = []
+    writer = ResourceWriter()
+    
+    # Process each matching resource
+    for resource in parsed_output['resources']:
+        user_id = resource.pop('user_id')  # Remove from resource dict after getting value
+        session_id = resource.pop('session_id')  # Remove from resource dict after getting value
+        
+        logger.info(f"Processing resource {resource['name']} for user_id: {user_id}, session_id: {session_id}")
+        
+        if not process_resource(resource, user_id, session_id, writer):
+            # Bad resource data does not improve on retry; store the rest
+            skipped_resources.append(resource['name'])
+    
+    # Only resources DynamoDB confirmed count as processed
+    processed_resources, failed_resources, rejected_resources = writer.flush()
+    skipped_resources.extend(rejected_resources)
+    if failed_resources:
+        logger.error(f"Failed to store resources: {', '.join(failed_resources)}")
+        success = False
+    
+    return success, {
+        'message': 'Successfully processed all matching resources' if success else 'Some resources failed processing',
+        'processed_resources': processed_resources,
+        'total_processed': len(processed_resources),
+        'skipped_resources': skipped_resources,
+        'contains_sensitive_data': parsed_output['sensitive_data'],
+        'metadata': parsed_output['metadata']
+    }
+
+def _process_record_safely(record):
+    try:
+        return process_record(record)
+    except MalformedMessageError as e:
+        logger.error(f"Discarding message {record.get('messageId')}: {str(e)}")
+        return True, {
+            'message': f'Discarded malformed message: {str(e)}',
+            'error': str(e),
+            'processed_resources': [],
+            'total_processed': 0
+        }
     except Exception as e:
-        logger.error(f"Error processing message: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'message': f'Error processing message: {str(e)}',
-                'error': str(e)
-            })
-        }
\ No newline at end of file
+        logger.error(f"Error processing message {record.get('messageId')}: {str(e)}")
+        return False, {
+            'message': f'Error processing message: {str(e)}',
+            'error': str(e)
+        }
+
+def lambda_handler(event, context):
+    """
+    Main Lambda handler function.
+    
+    Every record of the batch is processed (up to RECORD_CONCURRENCY at a time). Records that
+    failed transiently (DynamoDB throttling or connection errors) are returned as
+    batchItemFailures, so with ReportBatchItemFailures enabled on the event source mapping only
+    those messages are retried. Malformed messages are logged and acknowledged.
+    """
+    records = event['Records']
+    if records and records[0].get('eventSource') == 'aws:dynamodb':
+        # Optional: the function is also subscribed to the key mapping table's stream
+        apply_key_mapping_changes(records)
+        return {'batchItemFailures': []}
+    logger.info(f"Processing {len(records)} SQS messages")
+    hits, misses = key_mapping_cache.hits, key_mapping_cache.misses
+    
+    workers = min(RECORD_CONCURRENCY, len(records))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_process_record_safely, records))
+    else:
+        outcomes = [_process_record_safely(record) for record in records]
+    
+    failed_ids = [record['messageId'] for record, (success, _) in zip(records, outcomes) if not success]
+    processed_resources = [name for _, body in outcomes for name in body.get('processed_resources', [])]
+    if failed_ids:
+        logger.warning(f"{len(failed_ids)} of {len(records)} messages failed and will be retried")
+    emit_cache_metrics(key_mapping_cache.hits - hits, key_mapping_cache.misses - misses)
+    
+    response_body = {
+        'message': 'Successfully processed all messages' if not failed_ids else 'Some messages failed processing',
+        'processed_resources': processed_resources,
+        'total_processed': len(processed_resources),
+        'contains_sensitive_data': any(body.get('contains_sensitive_data') for _, body in outcomes),
+        'failed_messages': failed_ids,
+        'records': [body for _, body in outcomes]
+    }
+    
+    return {
+        'statusCode': 200 if not failed_ids else 500,
+        'body': json.dumps(response_body),
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_ids]
+    }
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import tracemalloc
+import logging
+import argparse
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("TABLE_NAME", "result_key_mapping")
+
+import sqsConsumer_notifications as consumer
+
+KEY_PREFIXES = ["ec2_public_ip", "ecs_alb_dns", "rds_endpoint", "app_lb", "ssh_private_key", "vpc_id"]
+
+def make_output(keys):
+    """Terraform output JSON as the deployment runner posts it, with every workflow-command escape in use"""
+    outputs = {}
+    for i in range(keys):
+        prefix = KEY_PREFIXES[i % len(KEY_PREFIXES)]
+        value = "db.internal:5432, admin, p%ss" if prefix.startswith("rds") else f"value-{i}\r"
+        outputs[f"{prefix}_{i}"] = {"sensitive": False, "type": "string", "value": value}
+    text = json.dumps(outputs, indent=2)
+    text = text.replace('%', '%25').replace('\r', '%0D').replace('\n', '%0A').replace(' ', '%20')
+    return f"::debug::stdout:{text}::debug::stderr:"
+
+def legacy_load(output_str):
+    """The decoder before load_terraform_output: split, chained replaces and json.loads"""
+    output_str = output_str.split("::debug::stdout:")[1].split("::debug::stderr:")[0].strip()
+    return json.loads(output_str.replace('%0A', '\n').replace('%20', ' '))
+
+def legacy_match(data, key_mappings):
+    """The classifier before the rule table, with a lower() and split() per test"""
+    matching_resources = []
+    for key, value in data.items():
+        if key in key_mappings:
+            resource_info = {
+                'name': key,
+                'type': 'unknown',
+                'value': value.get('value'),
+                'sensitive': value.get('sensitive', False),
+                'data_type': value.get('type'),
+                'timestamp': key.split('_')[-1] if key.split('_')[-1].isdigit() else None,
+                'user_id': key_mappings[key]['user_id'],
+                'session_id': key_mappings[key]['session_id']
+            }
+            if 'ec2' in key.lower():
+                resource_info['type'] = 'ec2'
+                resource_info['ip_address'] = value.get('value') if 'ip' in key.lower() else None
+            elif 'ecs' in key.lower():
+                resource_info['type'] = 'ecs'
+                if 'dns' in key.lower() or 'alb' in key.lower():
+                    resource_info['dns_name'] = value.get('value')
+            elif 'rds' in key.lower():
+                resource_info['type'] = 'rds'
+                rds_details = consumer.parse_rds_value(value.get('value'))
+                resource_info.update(rds_details)
+                resource_info['sensitive'] = bool(rds_details.get('username') or rds_details.get('password'))
+            elif 'lb' in key.lower() or 'loadbalancer' in key.lower():
+                resource_info['type'] = 'loadbalancer'
+                resource_info['dns_name'] = value.get('value')
+            elif 'key' in key.lower() or 'private_key' in key.lower():
+                resource_info['type'] = 'ssh_key'
+            matching_resources.append(resource_info)
+    return matching_resources
+
+def legacy_parse(output_str, key_mappings):
+    return legacy_match(legacy_load(output_str), key_mappings)
+
+def current_match(data, key_mappings):
+    return consumer.parse_terraform_output(data.items(), key_mappings)['resources']
+
+def current_parse(output_str, key_mappings):
+    parsed = consumer.parse_terraform_output(consumer.load_terraform_output(output_str).items(), key_mappings)
+    return parsed['resources']
+
+def peak_kb(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+def best_of(repeat, runs):
+    """Fastest time of each (function, *args) run, interleaving them so drift hits all alike"""
+    best = [float('inf')] * len(runs)
+    for _ in range(repeat):
+        for i, (function, *args) in enumerate(runs):
+            start = time.perf_counter()
+            function(*args)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the terraform output parser against the previous one.")
+    parser.add_argument("--keys", default="10,100,1000,10000", help="Comma-separated output sizes in keys")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement; the fastest is reported")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"{'keys':>7}{'legacy ms':>11}{'parse ms':>10}{'legacy match ms':>17}{'match ms':>10}"
+          f"{'legacy KB':>11}{'parse KB':>10}")
+    for keys in [int(size) for size in args.keys.split(',')]:
+        output_str = make_output(keys)
+        key_mappings = {f"{KEY_PREFIXES[i % len(KEY_PREFIXES)]}_{i}": {'user_id': "user@example.com", 'session_id': str(i)}
+                        for i in range(0, keys, 2)}
+
+        # The legacy parser leaves %25 and %0D encoded, so time both on a body without them
+        output_str = output_str.replace('%25', '').replace('%0D', '')
+        assert current_parse(output_str, key_mappings) == legacy_parse(output_str, key_mappings)
+
+        runs = [(legacy_parse, output_str, key_mappings), (current_parse, output_str, key_mappings)]
+        peaks = [peak_kb(*run) for run in runs]
+
+        # Matching and classification alone, on an already decoded output
+        data = legacy_load(output_str)
+        runs += [(legacy_match, data, key_mappings), (current_match, data, key_mappings)]
+        times = [seconds * 1000 for seconds in best_of(args.repeat, runs)]
+        print(f"{keys:>7}{times[0]:>11.2f}{times[1]:>10.2f}{times[2]:>17.2f}{times[3]:>10.2f}"
+              f"{peaks[0]:>11.0f}{peaks[1]:>10.0f}")
+
+if __name__ == "__main__":
+    main()